@@ -12,17 +12,16 @@ from PIL import Image
 import cv2
 import tempfile
 
+import request_log
 
 
-logger = logging.getLogger(__name__)
+logger = request_log.get_logger(__name__)
 
 
 def model_fn(model_dir):
     device = get_device()
-    print('device is')
-    print(device)
     model = torch.load(model_dir + '/model.pth', map_location=torch.device(device))
-    print(type(model))
+    logger.info("Loaded model", extra={"fields": {"device": device, "model": type(model).__name__}})
     return model
 
 
@@ -33,7 +32,7 @@ def input_fn(request_body, request_content_type):
     f = io.BytesIO(request_body)
     tfile = tempfile.NamedTemporaryFile(delete=False)
     tfile.write(f.read())
-    print(tfile.name)
+    logger.debug("Wrote the request video to %s", tfile.name)
     video_frames = video2frame(tfile,frame_width, frame_height, interval)  
     #convert to tensor of float32 type
     transform = transforms.Compose([
@@ -44,7 +43,6 @@ def input_fn(request_body, request_content_type):
     return image_tensors
 
 def predict_fn(data, model):
-    print('in custom predict function')
     with torch.no_grad():
         device = get_device()
         model = model.to(device)
@@ -57,8 +55,8 @@ def predict_fn(data, model):
     
 def output_fn(output_batch, accept='application/json'):
     res = []
-    print('output list length')
-    print(len(output_batch))
+    if request_log.sampled("/invocations"):
+        logger.info("Invoked", extra={"fields": {"frames": len(output_batch)}})
     for output in output_batch:
          res.append({'boxes':output['boxes'].detach().cpu().numpy().tolist(),'labels':output['labels'].detach().cpu().numpy().tolist(),'scores':output['scores'].detach().cpu().numpy().tolist()})
     
@@ -88,13 +86,13 @@ def video2frame(
         success = True
     else:
         success = False
-        print("Read failed!")
+        logger.warning("Read failed!")
 
     while success:
         success, frame = cap.read()
 
         if frame_index % interval == 0:
-            print("---> Reading the %d frame:" % frame_index, success)
+            logger.debug("---> Reading the %d frame: %s", frame_index, success)
             resize_frame = cv2.resize(
                 frame, (frame_width, frame_height), interpolation=cv2.INTER_AREA
             )
@@ -104,6 +102,5 @@ def video2frame(
         frame_index += 1
 
     cap.release()
-    print('Number of frames')
-    print(frame_count)
+    logger.debug("Number of frames: %d", frame_count)
     return video_frames
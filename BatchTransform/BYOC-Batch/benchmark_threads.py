@@ -0,0 +1,86 @@
+# Worker/thread split benchmark for the XGB container.
+#
+# Starts a number of worker processes, each loading container/XGB/model.json the way predictor.py does
+# with nthread set to its budget, and has every worker score batches back to back for a fixed time,
+# like busy gunicorn workers would. Every split of the cores between workers and booster threads is run
+# once with a DMatrix built per batch and once with inplace_predict, followed by the oversubscribed
+# split serve used to start (one worker per core, each booster using all the cores).
+#
+# Usage: python benchmark_threads.py [--rows 1000] [--seconds 5]
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+CONTAINER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "container", "XGB")
+sys.path.insert(0, CONTAINER)
+import threads  # noqa: E402
+
+
+def worker(mode, nthread, rows, seconds, start, results):
+    import xgboost as xgb
+
+    booster = xgb.Booster()
+    booster.load_model(os.path.join(CONTAINER, "model.json"))
+    booster.set_param({"nthread": nthread})
+    batch = np.random.RandomState(os.getpid()).standard_normal((rows, booster.num_features())).astype(np.float32)
+
+    start.wait()
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        began = time.perf_counter()
+        if mode == "dmatrix":
+            booster.predict(xgb.DMatrix(batch, nthread=nthread))
+        else:
+            booster.inplace_predict(batch)
+        latencies.append(time.perf_counter() - began)
+    results.put(latencies)
+
+
+def run(mode, workers, nthread, rows, seconds):
+    """Score for `seconds` in `workers` processes of `nthread` threads, return (rows/sec, latencies)."""
+    start = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=worker, args=(mode, nthread, rows, seconds, start, results))
+                 for _ in range(workers)]
+    for p in processes:
+        p.start()
+    # Give the workers time to load the model so they all start scoring together
+    time.sleep(1)
+    start.set()
+    latencies = []
+    for _ in processes:
+        latencies.extend(results.get())
+    for p in processes:
+        p.join()
+    return len(latencies) * rows / seconds, np.array(latencies) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    cpu_count = multiprocessing.cpu_count()
+    splits = [(workers, threads.budget(workers, cpu_count))
+              for workers in range(1, cpu_count + 1) if cpu_count % workers == 0]
+
+    print("cores={} rows/batch={} seconds={}".format(cpu_count, args.rows, args.seconds))
+    print("{:<12}{:>9}{:>9}{:>14}{:>12}{:>12}".format("mode", "workers", "nthread", "rows/s", "p50 ms", "p99 ms"))
+    if cpu_count > 1:
+        splits.append((cpu_count, cpu_count))
+    for workers, nthread in splits:
+        for mode in ("dmatrix", "inplace"):
+            throughput, latencies = run(mode, workers, nthread, args.rows, args.seconds)
+            print("{:<12}{:>9}{:>9}{:>14.0f}{:>12.2f}{:>12.2f}".format(
+                mode, workers, nthread, throughput, np.percentile(latencies, 50), np.percentile(latencies, 99)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+# Server hooks for gunicorn. serve passes this file with -c, and gunicorn also reads it by default when
+# it is started from this directory.
+
+
+def post_fork(server, worker):
+    # With --preload the master imported the app, and the model with it, before forking this worker,
+    # which picks up from there (see post_fork in predictor.py)
+    if server.cfg.preload_app:
+        import predictor
+        predictor.post_fork()
@@ -1,14 +1,93 @@
 from flask import Flask
 import flask
+import gc
 import os
 import json
 import logging
+import traceback
 import xgboost as xgb
 from io import StringIO
 import pandas as pd
 
+import codec
+import forest
+import metrics
+import request_log
+import streaming
+import threads
+
 xgb_reg = xgb.Booster()
 xgb_reg.load_model("model.json")
+# Only use this worker's share of the cores, see threads.py
+xgb_reg.set_param({"nthread": threads.from_env()})
+
+# With MODEL_SERVER_COMPILED_TREES the booster is flattened into numpy arrays by forest.compile and
+# scored without building a DMatrix, unless it doesn't score exactly like the booster
+compiled_reg = None
+
+
+def compile_trees():
+    global compiled_reg
+    if forest.enabled():
+        try:
+            compiled = forest.compile(xgb_reg)
+            forest.check(compiled, xgb_reg.inplace_predict)
+            compiled_reg = compiled
+        except NotImplementedError as e:
+            print("Serving with the native predict: {}".format(e))
+        except Exception:
+            # e.g. a library version the converter doesn't know, the booster is still served
+            print("Serving with the native predict, compiling the trees failed:")
+            traceback.print_exc()
+
+
+def post_fork():
+    """Set up a worker forked from a master that preloaded this module, called from gunicorn.conf.py."""
+    compile_trees()
+
+
+# With MODEL_SERVER_PRELOAD gunicorn imports this module, and loads the booster above, once in the
+# master before forking the workers, which then share it copy-on-write. Freezing the gc moves
+# everything allocated so far out of the collector's reach, so collections in the workers don't
+# write to those pages and un-share them. The parity check of the compiled trees scores with the
+# booster, which would start its OpenMP thread pool in the master and hang the forked workers, so
+# each worker compiles the trees in post_fork instead.
+if os.environ.get("MODEL_SERVER_PRELOAD", "false").lower() in ("1", "true", "yes"):
+    if hasattr(gc, "freeze"):
+        gc.freeze()
+else:
+    compile_trees()
+
+log = request_log.get_logger("predictor")
+
+# Latency of the decode, predict and encode stages of /invocations, summed over all gunicorn workers
+# and served on /metrics
+stage_metrics = metrics.Registry("model_server_stage_latency_seconds", ["decode", "predict", "encode"])
+
+
+def predict(data):
+    with stage_metrics.time("predict"):
+        if compiled_reg is not None:
+            return compiled_reg.predict(data)
+        # inplace_predict scores the array or frame directly, without copying it into a DMatrix first
+        return xgb_reg.inplace_predict(data)
+
+
+def stream_predictions(stream, rows_per_chunk):
+    """Score a CSV body chunk by chunk as it is read from stream, yielding CSV predictions."""
+    separator = ""
+    for chunk in streaming.csv_chunks(stream, rows_per_chunk):
+        with stage_metrics.time("decode"):
+            data = codec.decode(chunk, codec.CSV)
+        if request_log.sampled("/invocations"):
+            log.info("Streaming chunk", extra={"fields": {"records": data.shape[0]}, "payloads": {"input": data}})
+        preds = predict(data)
+        with stage_metrics.time("encode"):
+            result = codec.encode(preds, codec.CSV).rstrip("\n")
+        # Like the non-streaming response, the output has no trailing newline
+        yield separator + result
+        separator = "\n"
+
 
 # The flask app for serving predictions
 app = Flask(__name__)
@@ -20,31 +99,54 @@ def ping():
     return flask.Response(response= '\n', status=status, mimetype='application/json')
 
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    # Stage latency histograms of all workers in the Prometheus text format
+    return flask.Response(response=stage_metrics.render(), status=200, content_type='text/plain; version=0.0.4')
+
+
 @app.route('/invocations', methods=['POST'])
 def transformation():
     
     data = None
 
-    # Convert from CSV to pandas
-    if flask.request.content_type == "text/csv":
-        data = flask.request.data.decode("utf-8")
-        s = StringIO(data)
-        data = pd.read_csv(s, header=None)
-    else:
+    # In streaming mode CSV in, CSV out requests are read, scored and answered a chunk at a time. A
+    # chunk that fails to parse after the first ones have been sent can't change the status any
+    # more, it aborts the response instead.
+    if streaming.enabled() and flask.request.mimetype == codec.CSV:
+        accept = codec.negotiate(flask.request.accept_mimetypes, codec.CSV)
+        if accept == codec.CSV:
+            return flask.Response(
+                flask.stream_with_context(stream_predictions(flask.request.stream, streaming.chunk_rows())),
+                status=200, mimetype=codec.CSV
+            )
+
+    # Convert from CSV, NPY or Arrow to a frame the model can score
+    try:
+        with stage_metrics.time("decode"):
+            data = codec.decode(flask.request.get_data(), flask.request.mimetype)
+    except codec.UnsupportedContentType:
         return flask.Response(
-            response="This predictor only supports CSV data", status=415, mimetype="text/plain"
+            response="This predictor only supports {} data".format(", ".join(codec.supported())),
+            status=415, mimetype="text/plain"
         )
+    except codec.MalformedBody as e:
+        return flask.Response(response="{}\n".format(e), status=400, mimetype="text/plain")
+
+    accept = codec.negotiate(flask.request.accept_mimetypes, flask.request.mimetype)
     
-    print(data)
-    print(type(data))
-    preds = xgb_reg.predict(xgb.DMatrix(data))
-    print(preds)
+    preds = predict(data)
+    if request_log.sampled("/invocations"):
+        log.info("Invoked", extra={
+            "fields": {"records": data.shape[0], "content_type": flask.request.mimetype, "accept": accept},
+            "payloads": {"input": data, "predictions": preds},
+        })
     
-    out = StringIO()
-    pd.DataFrame({"results": preds}).to_csv(out, header=False, index=False)
-
-    result = out.getvalue().rstrip(
-        "\n"
-    )
+    with stage_metrics.time("encode"):
+        result = codec.encode(preds, accept)
+        if accept == codec.CSV:
+            result = result.rstrip(
+                "\n"
+            )
     
-    return flask.Response(response=result, status=200, mimetype='text/csv')
+    return flask.Response(response=result, status=200, mimetype=accept)
@@ -0,0 +1,55 @@
+# Chunked reading of large CSV request bodies. In streaming mode the predictor reads the body from the
+# socket a block at a time, scores it a fixed number of rows at a time and streams the predictions for
+# each chunk back as soon as they're ready, so peak memory depends on the chunk size instead of the
+# payload size.
+#
+# We set the following parameters:
+#
+# Parameter                Environment Variable              Default Value
+# ---------                --------------------              -------------
+# enable streaming         MODEL_SERVER_STREAMING            false
+# rows per chunk           MODEL_SERVER_STREAM_CHUNK_ROWS    10000
+
+import os
+
+# Bytes read from the request stream per call
+BLOCK_SIZE = 1 << 20
+
+
+def enabled():
+    """Return True if streaming mode was turned on through the environment."""
+    return os.environ.get("MODEL_SERVER_STREAMING", "false").lower() in ("1", "true", "yes")
+
+
+def chunk_rows():
+    return int(os.environ.get("MODEL_SERVER_STREAM_CHUNK_ROWS", 10000))
+
+
+def csv_chunks(stream, rows_per_chunk, block_size=BLOCK_SIZE):
+    """Yield the lines of a CSV stream as bodies of at most rows_per_chunk rows each.
+
+    Args:
+        stream (file-like): Binary stream to read the CSV from, e.g. the WSGI input.
+        rows_per_chunk (int): Maximum number of rows per yielded chunk.
+    Yields:
+        bytes: rows_per_chunk lines (fewer for the last chunk) joined by newlines. Blank lines are
+            dropped, the same as pandas does.
+    """
+    partial = b""
+    rows = []
+    while True:
+        block = stream.read(block_size)
+        if block:
+            lines = (partial + block).split(b"\n")
+            # The last piece is either empty or a row that continues in the next block
+            partial = lines.pop()
+            rows.extend(line for line in lines if line.strip())
+        elif partial.strip():
+            rows.append(partial)
+
+        while len(rows) >= rows_per_chunk or (rows and not block):
+            yield b"\n".join(rows[:rows_per_chunk])
+            del rows[:rows_per_chunk]
+
+        if not block:
+            return
@@ -0,0 +1,190 @@
+# Local stand-in for a Batch Transform job against the XGB container, to tune MaxPayloadInMB and
+# MaxConcurrentTransforms offline.
+#
+# Every file under the input directory is split into records by line (SplitType=Line). Records are
+# packed into mini-batches of at most MaxPayloadInMB each (BatchStrategy=MultiRecord), or sent one per
+# request (SingleRecord). Up to MaxConcurrentTransforms mini-batches are scored at a time by one of:
+#
+#   process  a pool of local processes, each importing container/XGB/predictor.py and calling its
+#            flask app directly (the default)
+#   thread   the flask app in this process, called from a pool of threads
+#   http     a running container, e.g. `docker run -p 8080:8080 <image> serve`, given by --endpoint
+#
+# The responses for each input file are written in order to <output>/<relative path>.out, put together
+# the way AssembleWith does: back to back for None, which is the job default, or one per line for Line.
+# A MaxPayloadInMB of 0 sends every file in a single request, as SageMaker does for streaming
+# containers. MODEL_SERVER_* variables in the environment reach the process and thread backends.
+#
+# Usage: python local_transform.py <input dir> <output dir> [--max-payload-mb 6]
+#            [--max-concurrent-transforms 4] [--batch-strategy MultiRecord|SingleRecord]
+#            [--assemble-with None|Line] [--backend process|thread|http] [--endpoint URL]
+
+import argparse
+import collections
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.request import Request, urlopen
+
+import numpy as np
+
+CONTAINER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "container", "XGB")
+CONTENT_TYPE = "text/csv"
+
+# The flask test client of the predictor in this process, set up by _start_predictor
+_client = None
+
+
+def _start_predictor():
+    global _client
+    # predictor.py loads model.json from the working directory, as it does in /opt/program
+    os.chdir(CONTAINER)
+    sys.path.insert(0, CONTAINER)
+    import predictor
+    _client = predictor.app.test_client()
+
+
+def _invoke_local(payload):
+    start = time.perf_counter()
+    response = _client.post("/invocations", data=payload, content_type=CONTENT_TYPE)
+    return response.status_code, response.get_data(), time.perf_counter() - start
+
+
+def _invoke_http(endpoint, payload):
+    start = time.perf_counter()
+    request = Request(endpoint.rstrip("/") + "/invocations", data=payload, headers={"Content-Type": CONTENT_TYPE})
+    with urlopen(request) as response:
+        return response.status, response.read(), time.perf_counter() - start
+
+
+def input_files(input_dir):
+    """All files under input_dir, in the key order of an S3 prefix listing."""
+    files = []
+    for root, _, names in os.walk(input_dir):
+        for name in names:
+            files.append(os.path.relpath(os.path.join(root, name), input_dir))
+    return sorted(files)
+
+
+def mini_batches(path, max_payload, single_record):
+    """Split a file by line into payloads of at most max_payload bytes, yield (payload, records).
+
+    A max_payload of 0 yields the whole file as one payload.
+    """
+    records = []
+    size = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            if not line.endswith(b"\n"):
+                line += b"\n"
+            if max_payload and len(line) > max_payload:
+                raise ValueError("A record in {} is larger than MaxPayloadInMB ({} bytes)".format(path, len(line)))
+            if records and (single_record or (max_payload and size + len(line) > max_payload)):
+                yield b"".join(records), len(records)
+                records = []
+                size = 0
+            records.append(line)
+            size += len(line)
+    if records:
+        yield b"".join(records), len(records)
+
+
+def transform(args, invoke, executor):
+    max_payload = int(args.max_payload_mb * 1024 * 1024)
+    single_record = args.batch_strategy == "SingleRecord"
+    separator = b"\n" if args.assemble_with == "Line" else b""
+
+    def batches():
+        for name in input_files(args.input):
+            for payload, records in mini_batches(os.path.join(args.input, name), max_payload, single_record):
+                yield name, payload, records
+
+    stats = collections.Counter()
+    latencies = []
+    current = {"name": None, "out": None}
+    in_flight = collections.deque()
+
+    def write_next():
+        name, records, size, future = in_flight.popleft()
+        status, body, seconds = future.result()
+        if status != 200:
+            raise RuntimeError("Mini-batch of {} records from {} failed with {}: {}".format(
+                records, name, status, body[:500].decode("utf-8", "replace")))
+        if name != current["name"]:
+            # Mini-batches come back in submission order, so the previous file is complete
+            if current["out"] is not None:
+                current["out"].close()
+            out_path = os.path.join(args.output, name + ".out")
+            if not os.path.isdir(os.path.dirname(out_path)):
+                os.makedirs(os.path.dirname(out_path))
+            current["name"], current["out"] = name, open(out_path, "wb")
+            stats["files"] += 1
+        current["out"].write(body + separator)
+        stats["records"] += records
+        stats["bytes"] += size
+        stats["batches"] += 1
+        latencies.append(seconds)
+
+    start = time.perf_counter()
+    # Keep MaxConcurrentTransforms mini-batches in the pool and as many queued behind them, so the
+    # input is read as fast as it's scored rather than all at once
+    for name, payload, records in batches():
+        in_flight.append((name, records, len(payload), executor.submit(invoke, payload)))
+        if len(in_flight) >= 2 * args.max_concurrent_transforms:
+            write_next()
+    while in_flight:
+        write_next()
+    elapsed = time.perf_counter() - start
+    if current["out"] is not None:
+        current["out"].close()
+    return stats, elapsed, np.array(latencies) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--max-payload-mb", type=float, default=6)
+    parser.add_argument("--max-concurrent-transforms", type=int, default=4)
+    parser.add_argument("--batch-strategy", choices=["MultiRecord", "SingleRecord"], default="MultiRecord")
+    parser.add_argument("--assemble-with", choices=["None", "Line"], default="None")
+    parser.add_argument("--backend", choices=["process", "thread", "http"], default="process")
+    parser.add_argument("--endpoint", default="http://localhost:8080")
+    args = parser.parse_args()
+
+    if args.max_payload_mb < 0 or args.max_payload_mb > 100:
+        parser.error("--max-payload-mb must be between 0 and 100")
+
+    concurrency = args.max_concurrent_transforms
+    if args.backend == "process":
+        executor = ProcessPoolExecutor(max_workers=concurrency, initializer=_start_predictor)
+        invoke = _invoke_local
+    elif args.backend == "thread":
+        _start_predictor()
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        invoke = _invoke_local
+    else:
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        invoke = lambda payload: _invoke_http(args.endpoint, payload)
+
+    with executor:
+        if args.backend == "process":
+            # Load the model in every worker before the clock starts
+            list(executor.map(time.sleep, [0.5] * concurrency))
+        stats, elapsed, latencies = transform(args, invoke, executor)
+
+    print("backend={} MaxPayloadInMB={} MaxConcurrentTransforms={} BatchStrategy={} AssembleWith={}".format(
+        args.backend, args.max_payload_mb, concurrency, args.batch_strategy, args.assemble_with))
+    print("{} files, {} records in {} mini-batches, {:.1f} MB in {:.2f}s".format(
+        stats["files"], stats["records"], stats["batches"], stats["bytes"] / 1e6, elapsed))
+    if stats["batches"]:
+        print("{:.0f} records/s, {:.1f} MB/s, mini-batch p50 {:.1f}ms, p99 {:.1f}ms".format(
+            stats["records"] / elapsed, stats["bytes"] / 1e6 / elapsed,
+            np.percentile(latencies, 50), np.percentile(latencies, 99)))
+
+
+if __name__ == "__main__":
+    main()
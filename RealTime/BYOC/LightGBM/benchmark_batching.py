@@ -0,0 +1,90 @@
+# Throughput vs latency benchmark for the micro-batching layer in container/regressor/batching.py.
+#
+# Trains the same models the train scripts produce (a 10 round LightGBM booster, or a 30 tree
+# RandomForest for the Sklearn container) on the petrol data, then drives them from a pool of
+# concurrent client threads that each send small requests, first with every request scored on its
+# own and then through MicroBatcher with a few max-wait windows.
+#
+# Usage: python benchmark_batching.py [--model lgb|rf] [--clients 32] [--rows 1] [--requests 2000]
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "container", "regressor"))
+import batching  # noqa: E402
+
+
+def train_model(kind):
+    df = pd.read_csv(os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "petrol_consumption.csv"))
+    X = df.drop("Petrol_Consumption", axis=1)
+    y = df["Petrol_Consumption"]
+    if kind == "lgb":
+        import lightgbm as lgb
+        return lgb.train({"objective": "regression", "verbose": -1}, train_set=lgb.Dataset(X, y), num_boost_round=10), X
+    from sklearn.ensemble import RandomForestRegressor
+    return RandomForestRegressor(n_estimators=30).fit(X.values, y), X
+
+
+def run(predict, frames, clients):
+    """Send every frame through predict from `clients` threads, return (requests/sec, latencies)."""
+    latencies = [None] * len(frames)
+    cursor = iter(range(len(frames)))
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                i = next(cursor, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            predict(frames[i])
+            latencies[i] = time.perf_counter() - start
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return len(frames) / elapsed, np.array(latencies) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", choices=["lgb", "rf"], default="lgb")
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--rows", type=int, default=1)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    model, X = train_model(args.model)
+    rng = np.random.default_rng(0)
+    frames = [X.iloc[rng.integers(0, len(X), args.rows)].reset_index(drop=True) for _ in range(args.requests)]
+    if args.model == "rf":
+        frames = [f.values for f in frames]
+
+    print("model={} clients={} rows/request={} requests={}".format(args.model, args.clients, args.rows, args.requests))
+    print("{:<24}{:>12}{:>12}{:>12}".format("mode", "req/s", "p50 ms", "p99 ms"))
+
+    configs = [("unbatched", None)] + [("batched wait={}ms".format(w), w) for w in (0.5, 2, 5, 10)]
+    for name, wait in configs:
+        if wait is None:
+            predict = model.predict
+        else:
+            predict = batching.MicroBatcher(model.predict, max_batch_size=args.max_batch_size, max_wait_ms=wait).predict
+        throughput, latencies = run(predict, frames, args.clients)
+        print("{:<24}{:>12.0f}{:>12.2f}{:>12.2f}".format(
+            name, throughput, np.percentile(latencies, 50), np.percentile(latencies, 99)))
+
+
+if __name__ == "__main__":
+    main()
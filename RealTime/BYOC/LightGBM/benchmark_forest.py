@@ -0,0 +1,106 @@
+# Parity check and latency benchmark for the compiled tree evaluator in forest.py.
+#
+# For each model type the container family serves (the LightGBM booster and RandomForest trained on
+# the petrol data the way the train scripts do, and the pre-trained XGBoost model.json shipped with the
+# Batch Transform example) this compiles the model with the forest.py of the container that serves it,
+# checks that the compiled predictions are exactly the native predict's, on the rows forest.check
+# scores at load time and on a few thousand more including missing values, and then times both at
+# batch sizes 1-10.
+#
+# Usage: python benchmark_forest.py [--model lgb rf xgb] [--repeat 2000]
+
+import argparse
+import importlib.util
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+XGB_CONTAINER = os.path.join(HERE, "..", "..", "..", "BatchTransform", "BYOC-Batch", "container", "XGB")
+XGB_MODEL = os.path.join(XGB_CONTAINER, "model.json")
+# The container directory whose forest.py serves each model type
+CONTAINERS = {
+    "lgb": os.path.join(HERE, "container", "regressor"),
+    "rf": os.path.join(HERE, "..", "Sklearn", "Sklearn-Regressor", "container", "randomForest"),
+    "xgb": XGB_CONTAINER,
+}
+
+
+def forest_module(kind):
+    spec = importlib.util.spec_from_file_location("forest_" + kind, os.path.join(CONTAINERS[kind], "forest.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def petrol():
+    df = pd.read_csv(os.path.join(HERE, "data", "petrol_consumption.csv"))
+    return df.drop("Petrol_Consumption", axis=1), df["Petrol_Consumption"]
+
+
+def load(kind):
+    """Return (model, native predict on a 2-d array, sample rows to score)."""
+    rng = np.random.default_rng(0)
+    if kind == "xgb":
+        import xgboost as xgb
+        booster = xgb.Booster()
+        booster.load_model(XGB_MODEL)
+        n_features = booster.num_features()
+        rows = rng.normal(size=(4000, n_features)) * 3
+        return booster, booster.inplace_predict, rows
+
+    X, y = petrol()
+    # Jitter the training rows so the check covers values on both sides of every threshold
+    rows = X.values[rng.integers(0, len(X), 4000)] * rng.uniform(0.8, 1.2, size=(4000, X.shape[1]))
+    if kind == "lgb":
+        import lightgbm as lgb
+        booster = lgb.train({"objective": "regression", "verbose": -1}, train_set=lgb.Dataset(X, y), num_boost_round=10)
+        return booster, booster.predict, rows
+    from sklearn.ensemble import RandomForestRegressor
+    regressor = RandomForestRegressor(n_estimators=30).fit(X.values, y)
+    return regressor, regressor.predict, rows
+
+
+def timed(fn, X, repeat):
+    fn(X)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(X)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", nargs="+", choices=["lgb", "rf", "xgb"], default=["lgb", "rf", "xgb"])
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    for kind in args.model:
+        model, native, rows = load(kind)
+        forest = forest_module(kind)
+        compiled = forest.compile(model)
+
+        # Parity, on the rows the predictor checks at load time and then with a sprinkling of missing
+        # values for the models that can take them
+        forest.check(compiled, native)
+        X = rows.copy()
+        if kind != "rf":
+            X[np.random.default_rng(1).random(X.shape) < 0.05] = np.nan
+        expected, actual = native(X), compiled.predict(X)
+        np.testing.assert_array_equal(actual, expected)
+        print("\n{}: {} trees, depth {}, {} from {}, max abs diff {:.3g} over {} rows".format(
+            kind, len(compiled.roots), compiled.depth, os.path.basename(forest.__file__),
+            os.path.relpath(CONTAINERS[kind], HERE), np.abs(actual - expected).max(), len(X)))
+
+        print("{:<8}{:>14}{:>16}{:>10}".format("rows", "native us", "compiled us", "speedup"))
+        for n in (1, 2, 5, 10):
+            batch = rows[:n]
+            native_us = timed(native, batch, args.repeat)
+            compiled_us = timed(compiled.predict, batch, args.repeat)
+            print("{:<8}{:>14.1f}{:>16.1f}{:>9.1f}x".format(n, native_us, compiled_us, native_us / compiled_us))
+
+
+if __name__ == "__main__":
+    main()
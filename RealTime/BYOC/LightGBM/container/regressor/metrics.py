@@ -0,0 +1,144 @@
+# Latency histograms for the stages of /invocations, shared between gunicorn workers and served in
+# the Prometheus text format on /metrics.
+#
+# Every worker keeps its histograms in a small memory-mapped file of its own under
+# MODEL_SERVER_METRICS_DIR (serve empties the directory at start-up), so recording an observation is
+# a couple of in-memory additions with no locking between processes. /metrics, whichever worker it
+# lands on, adds up the files of all workers. Histograms and counters include the workers that have
+# since exited, so they only ever go up. Gauges, like the number of entries in a worker's cache, only
+# include the workers that are still running, as an exited worker's values are gone with it.
+
+import os
+import threading
+import time
+
+import numpy as np
+
+# Bucket upper bounds in seconds, from 50us for the codecs up to 10s for very large payloads
+BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0)
+
+metrics_dir = os.environ.get("MODEL_SERVER_METRICS_DIR", "/tmp/model_server_metrics")
+
+
+class _Timer(object):
+
+    def __init__(self, registry, stage):
+        self.registry = registry
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+def _running(pid):
+    """Return True if a process with this pid exists."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Registry(object):
+    """Per-stage latency histograms, per-worker counters and gauges backed by a file for each worker.
+
+    Args:
+        name (str): Metric name of the histograms, one label value per stage.
+        stages (list of str): The stages that are timed.
+        counters (list of str): Extra per-worker totals that only go up, e.g. cache hits, reported
+            as their sum over all workers, exited ones included.
+        gauges (list of str): Extra per-worker values, e.g. cache entries, reported as their sum
+            over the running workers.
+    """
+
+    def __init__(self, name, stages, counters=(), gauges=()):
+        self.name = name
+        self.stages = list(stages)
+        self.counters = list(counters)
+        self.gauges = list(gauges)
+        # Per stage: one count per bucket, the +Inf bucket, then the sum of observed values. The
+        # counters and then the gauges follow the stages.
+        self._row = len(BUCKETS) + 2
+        self._gauges = len(self.stages) * self._row + len(self.counters)
+        self._size = self._gauges + len(self.gauges)
+        self._bounds = np.array(BUCKETS)
+        self._lock = threading.Lock()
+        self._values = None
+        self._pid = None
+
+    def _array(self):
+        # Each worker opens its own file the first time it records something after the fork
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    if not os.path.isdir(metrics_dir):
+                        os.makedirs(metrics_dir)
+                    path = os.path.join(metrics_dir, "{}-{}.bin".format(self.name, os.getpid()))
+                    self._values = np.memmap(path, dtype=np.float64, mode="w+", shape=(self._size,))
+                    self._pid = os.getpid()
+        return self._values
+
+    def time(self, stage):
+        """Context manager that records the time spent in its block under stage."""
+        return _Timer(self, stage)
+
+    def observe(self, stage, seconds):
+        values = self._array()
+        offset = self.stages.index(stage) * self._row
+        bucket = int(np.searchsorted(self._bounds, seconds))
+        with self._lock:
+            values[offset + bucket] += 1
+            values[offset + self._row - 1] += seconds
+
+    def set(self, name, value):
+        """Set this worker's value of a counter or a gauge."""
+        if name in self.counters:
+            index = len(self.stages) * self._row + self.counters.index(name)
+        else:
+            index = self._gauges + self.gauges.index(name)
+        self._array()[index] = value
+
+    def _collect(self):
+        total = np.zeros(self._size)
+        prefix = self.name + "-"
+        for entry in os.listdir(metrics_dir) if os.path.isdir(metrics_dir) else []:
+            if entry.startswith(prefix) and entry.endswith(".bin"):
+                values = np.fromfile(os.path.join(metrics_dir, entry), dtype=np.float64)
+                if values.shape != total.shape:
+                    continue
+                pid = entry[len(prefix):-len(".bin")]
+                if pid.isdigit() and not _running(int(pid)):
+                    # The worker has exited (or was recycled), its gauges are stale
+                    values[self._gauges:] = 0
+                total += values
+        return total
+
+    def render(self):
+        """All workers' metrics in the Prometheus text exposition format."""
+        total = self._collect()
+        lines = [
+            "# HELP {} Time spent in each stage of /invocations.".format(self.name),
+            "# TYPE {} histogram".format(self.name),
+        ]
+        for i, stage in enumerate(self.stages):
+            row = total[i * self._row:(i + 1) * self._row]
+            cumulative = np.cumsum(row[:-1])
+            for bound, count in zip(BUCKETS + ("+Inf",), cumulative):
+                lines.append('{}_bucket{{stage="{}",le="{}"}} {:.0f}'.format(self.name, stage, bound, count))
+            lines.append('{}_sum{{stage="{}"}} {!r}'.format(self.name, stage, float(row[-1])))
+            lines.append('{}_count{{stage="{}"}} {:.0f}'.format(self.name, stage, cumulative[-1]))
+        for i, counter in enumerate(self.counters):
+            lines.append("# TYPE {} counter".format(counter))
+            lines.append("{} {!r}".format(counter, float(total[len(self.stages) * self._row + i])))
+        for i, gauge in enumerate(self.gauges):
+            lines.append("# TYPE {} gauge".format(gauge))
+            lines.append("{} {!r}".format(gauge, float(total[self._gauges + i])))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,32 @@
+# CPU budget of the gunicorn workers. serve starts MODEL_SERVER_WORKERS workers, and left alone the
+# booster in each of them would run one thread per core, so under load there are workers x cores
+# threads fighting over the cores. Instead the cores are divided between the workers and every
+# booster gets its share as nthread.
+#
+# We set the following parameters:
+#
+# Parameter                Environment Variable              Default Value
+# ---------                --------------------              -------------
+# booster threads/worker   MODEL_SERVER_NTHREAD              the number of CPU cores divided by
+#                                                            MODEL_SERVER_WORKERS, at least 1
+#
+# serve works the value out once and exports it, along with OMP_NUM_THREADS, to the workers.
+
+import multiprocessing
+import os
+
+
+def budget(workers, cpu_count=None):
+    """Threads each of `workers` processes can use without oversubscribing cpu_count cores."""
+    if cpu_count is None:
+        cpu_count = multiprocessing.cpu_count()
+    return max(1, cpu_count // max(1, workers))
+
+
+def from_env():
+    """The booster nthread for this worker: MODEL_SERVER_NTHREAD, or its share of the cores."""
+    nthread = int(os.environ.get("MODEL_SERVER_NTHREAD", 0))
+    if nthread > 0:
+        return nthread
+    cpu_count = multiprocessing.cpu_count()
+    return budget(int(os.environ.get("MODEL_SERVER_WORKERS", cpu_count)), cpu_count)
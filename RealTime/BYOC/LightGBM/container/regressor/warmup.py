@@ -0,0 +1,158 @@
+# Start-up phase of the predictor. Each worker loads the model, unless the gunicorn master already did
+# with MODEL_SERVER_PRELOAD, and then scores a few synthetic batches before /ping reports healthy, so the
+# first real requests don't pay for unpickling, first-call library code paths and allocator growth. The
+# warm-up always runs in the worker, after the fork: scoring in the master would start the model's
+# OpenMP thread pool there, which the forked workers would hang on.
+#
+# The synthetic batches are drawn from the rows of a sample payload, by default the first of
+# sample-payload.csv, sample-payload.npy or sample-payload.arrow found next to the model in
+# /opt/ml/model. The sample is decoded by codec.decode like a request, which also teaches the worker
+# the CSV schema. Without a sample the batches are random rows with as many features as the model.
+#
+# We set the following parameters:
+#
+# Parameter                Environment Variable              Default Value
+# ---------                --------------------              -------------
+# warm-up predictions      MODEL_SERVER_WARMUP               true
+# sample payload           MODEL_SERVER_WARMUP_SAMPLE        sample-payload.* in /opt/ml/model
+# rows per warm-up batch   MODEL_SERVER_WARMUP_BATCH_SIZES   1,10,100
+# batches per size         MODEL_SERVER_WARMUP_ROUNDS        3
+
+import os
+import threading
+import time
+import traceback
+
+import numpy as np
+
+import codec
+
+SAMPLE_NAME = "sample-payload"
+_EXTENSIONS = {".csv": codec.CSV, ".npy": codec.NPY, ".arrow": codec.ARROW}
+
+
+def from_env(model_path, load, score):
+    """Build the Startup for a model in model_path from the environment."""
+    enabled = os.environ.get("MODEL_SERVER_WARMUP", "true").lower() in ("1", "true", "yes")
+    sizes = os.environ.get("MODEL_SERVER_WARMUP_BATCH_SIZES", "1,10,100")
+    return Startup(load, score,
+                   sample_path=os.environ.get("MODEL_SERVER_WARMUP_SAMPLE") or find_sample(model_path),
+                   batch_sizes=[int(size) for size in sizes.split(",") if size.strip()] if enabled else [],
+                   rounds=int(os.environ.get("MODEL_SERVER_WARMUP_ROUNDS", 3)))
+
+
+def find_sample(model_path):
+    """Return the path of the sample payload in model_path, or None if there isn't one."""
+    for extension in _EXTENSIONS:
+        path = os.path.join(model_path, SAMPLE_NAME + extension)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+class Startup(object):
+    """Loads the model and warms it up, once, and tells /ping whether that has finished.
+
+    Args:
+        load (callable): Loads the model and returns it, e.g. ScoringService.load.
+        score (callable): Scores a batch with the model, bypassing any cache or batcher in front of it
+            so the warm-up rows don't end up in the prediction cache.
+        sample_path (str): Sample payload to take the warm-up rows from, or None.
+        batch_sizes (list of int): Rows per warm-up batch. Empty to only load the model.
+        rounds (int): Number of batches scored for each size.
+    """
+
+    def __init__(self, load, score, sample_path=None, batch_sizes=(), rounds=3):
+        self.load = load
+        self.score = score
+        self.sample_path = sample_path
+        self.batch_sizes = list(batch_sizes)
+        self.rounds = rounds
+        self.failed = False
+        self._done = threading.Event()
+
+    def start(self):
+        """Run the start-up phase on a background thread, so the worker can answer /ping meanwhile."""
+        thread = threading.Thread(target=self.run, name="model-startup")
+        thread.daemon = True
+        thread.start()
+
+    def ready(self):
+        return self._done.is_set() and not self.failed
+
+    def ping_status(self):
+        """HTTP status for /ping: 200 when ready, 503 while still starting, 404 if the model failed to load."""
+        if not self._done.is_set():
+            return 503
+        return 404 if self.failed else 200
+
+    def run(self):
+        started = time.perf_counter()
+        try:
+            model = self.load()
+        except Exception:
+            print("Startup failed, the model could not be loaded:")
+            traceback.print_exc()
+            self.failed = True
+            self._done.set()
+            return
+        loaded = time.perf_counter()
+
+        predictions = 0
+        if self.batch_sizes:
+            # A broken sample shouldn't keep a loadable model from serving, it only costs the warm-up
+            try:
+                predictions = self._warm_up(model)
+            except Exception:
+                print("Warm-up failed, serving without it:")
+                traceback.print_exc()
+        finished = time.perf_counter()
+
+        print("Startup of pid {}: model loaded in {:.3f}s, {} warm-up predictions in {:.3f}s, ready after {:.3f}s"
+              .format(os.getpid(), loaded - started, predictions, finished - loaded, finished - started))
+        self._done.set()
+
+    def _warm_up(self, model):
+        rows = self._sample_rows(model)
+        if rows is None:
+            print("No sample payload and no feature count on the model, skipping the warm-up predictions")
+            return 0
+
+        rng = np.random.RandomState(0)
+        count = 0
+        for size in self.batch_sizes:
+            latencies = []
+            for _ in range(self.rounds):
+                batch = rows[rng.randint(0, len(rows), size)]
+                start = time.perf_counter()
+                predictions = self.score(batch)
+                latencies.append(time.perf_counter() - start)
+                # Encoding the predictions in every response format warms up the codecs as well
+                for accept in codec.supported():
+                    codec.encode(predictions, accept)
+                count += 1
+            if latencies:
+                print("Warm-up batches of {} rows: first {:.2f}ms, last {:.2f}ms".format(
+                    size, latencies[0] * 1000, latencies[-1] * 1000))
+        return count
+
+    def _sample_rows(self, model):
+        if self.sample_path is not None:
+            content_type = _EXTENSIONS.get(os.path.splitext(self.sample_path)[1].lower(), codec.CSV)
+            with open(self.sample_path, "rb") as sample:
+                body = sample.read()
+            # The first CSV decode goes through pandas and learns the schema, the second takes the fast
+            # path real requests will take
+            codec.decode(body, content_type)
+            rows = np.asarray(codec.decode(body, content_type))
+            print("Warming up with rows from {}, {} rows of {} features".format(
+                self.sample_path, rows.shape[0], rows.shape[1]))
+            return rows
+
+        features = getattr(model, "n_features_in_", None)
+        if features is None and hasattr(model, "num_feature"):
+            features = model.num_feature()
+        if not features:
+            return None
+        print("No sample payload found, warming up with random rows of {} features".format(features))
+        return np.random.RandomState(0).standard_normal((100, features)).astype(np.float32)
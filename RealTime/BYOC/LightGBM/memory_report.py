@@ -0,0 +1,123 @@
+# Per-worker memory report for the gunicorn model server with and without MODEL_SERVER_PRELOAD.
+#
+# Starts gunicorn on a local port for the given program directory, once per mode, sends some CSV
+# requests so that every worker has scored at least a few, and then reads RSS and PSS for the master
+# and each worker from /proc/<pid>/smaps_rollup (Linux only). RSS counts shared pages in full for
+# every process, PSS splits them between the processes sharing them, so the PSS total is the real
+# memory cost of the server.
+#
+# The predictor loads its model from /opt/ml/model as it does in the container, so train or copy
+# lgb-model.pkl (or rf-model.pkl) there first.
+#
+# Usage: python memory_report.py [--program container/regressor] [--workers 4] [--payload file.csv]
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def children(pid):
+    """Pids of the direct children of pid, i.e. the gunicorn workers."""
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/{}/stat".format(entry)) as f:
+                # The command name is in parentheses and may contain spaces, ppid follows the state
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            pids.append(int(entry))
+    return sorted(pids)
+
+
+def memory(pid):
+    """Return (rss, pss) of pid in MiB."""
+    values = {}
+    with open("/proc/{}/smaps_rollup".format(pid)) as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in ("Rss", "Pss"):
+                values[key] = int(rest.split()[0]) / 1024.0
+    return values["Rss"], values["Pss"]
+
+
+def measure(program, workers, payload, requests, preload):
+    port = free_port()
+    # The same settings serve starts gunicorn with, the master of a preloading server runs OpenMP on one thread
+    sys.path.insert(0, program)
+    import threads
+    env = dict(os.environ, MODEL_SERVER_PRELOAD="true" if preload else "false",
+               MODEL_SERVER_NTHREAD=str(threads.budget(workers)))
+    args = ["gunicorn", "--chdir", program, "-c", os.path.join(program, "gunicorn.conf.py"), "-k", "sync",
+            "-b", "127.0.0.1:{}".format(port), "-w", str(workers)]
+    if preload:
+        args.append("--preload")
+        env["OMP_NUM_THREADS"] = "1"
+    server = subprocess.Popen(args + ["wsgi:app"], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        url = "http://127.0.0.1:{}".format(port)
+        deadline = time.time() + 60
+        while True:
+            try:
+                urllib.request.urlopen(url + "/ping").read()
+                break
+            except OSError:
+                if time.time() > deadline or server.poll() is not None:
+                    raise RuntimeError("gunicorn did not come up on port {}".format(port))
+                time.sleep(0.2)
+
+        for _ in range(requests):
+            request = urllib.request.Request(url + "/invocations", data=payload, headers={"Content-Type": "text/csv"})
+            urllib.request.urlopen(request).read()
+
+        master = memory(server.pid)
+        return master, [memory(pid) for pid in children(server.pid)]
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--program", default=os.path.join(HERE, "container", "regressor"))
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--payload", help="CSV request body, defaults to the petrol features")
+    args = parser.parse_args()
+
+    if args.payload:
+        with open(args.payload, "rb") as f:
+            payload = f.read()
+    else:
+        import pandas as pd
+        df = pd.read_csv(os.path.join(HERE, "data", "petrol_consumption.csv"))
+        payload = df.drop("Petrol_Consumption", axis=1).head(10).to_csv(header=False, index=False).encode()
+
+    for preload in (False, True):
+        master, workers = measure(os.path.abspath(args.program), args.workers, payload, args.requests, preload)
+        print("\npreload={}".format(preload))
+        print("{:<10}{:>12}{:>12}".format("process", "RSS MiB", "PSS MiB"))
+        print("{:<10}{:>12.1f}{:>12.1f}".format("master", master[0], master[1]))
+        for i, (rss, pss) in enumerate(workers):
+            print("{:<10}{:>12.1f}{:>12.1f}".format("worker {}".format(i), rss, pss))
+        total_pss = master[1] + sum(pss for _, pss in workers)
+        print("{:<10}{:>12}{:>12.1f}".format("total", "", total_pss))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
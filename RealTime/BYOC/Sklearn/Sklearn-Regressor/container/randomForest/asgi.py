@@ -0,0 +1,112 @@
+# Async version of the predictor app for the asgi worker class in serve. It answers /ping and
+# /invocations exactly like the flask app in predictor.py, but on uvicorn's event loop: the request
+# body is read without tying up a thread, and ScoringService.predict (with the cache and micro-batcher
+# when they are enabled) runs on a pool of MODEL_SERVER_THREADS threads so the loop stays free for
+# other requests.
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header, parse_options_header
+
+import codec
+import request_log
+from predictor import ScoringService, log, stage_metrics, startup
+
+# asyncio.get_event_loop() rather than get_running_loop(), which the Python 3.6 of the scikit-learn image
+# doesn't have. Called from a coroutine, both return the loop it runs on.
+
+model_server_threads = int(os.environ.get("MODEL_SERVER_THREADS", 4))
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+
+    if scope["path"] == "/ping" and scope["method"] == "GET":
+        await ping(send)
+    elif scope["path"] == "/metrics" and scope["method"] == "GET":
+        await _respond(send, 200, stage_metrics.render(), "text/plain; version=0.0.4")
+    elif scope["path"] == "/invocations" and scope["method"] == "POST":
+        await transformation(scope, receive, send)
+    else:
+        await _respond(send, 404, "{}", "application/json")
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            asyncio.get_event_loop().set_default_executor(ThreadPoolExecutor(model_server_threads))
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def ping(send):
+    """Determine if the container is working and healthy, the same check as predictor.ping."""
+    await _respond(send, startup.ping_status(), "\n", "application/json")
+
+
+async def transformation(scope, receive, send):
+    headers = dict((k.decode("latin-1").lower(), v.decode("latin-1")) for k, v in scope["headers"])
+    content_type = parse_options_header(headers.get("content-type", ""))[0]
+    body = await _read_body(receive)
+
+    # Convert from CSV, NPY or Arrow to a frame the model can score
+    try:
+        with stage_metrics.time("decode"):
+            data = codec.decode(body, content_type)
+    except codec.UnsupportedContentType:
+        await _respond(send, 415, "This predictor only supports {} data".format(", ".join(codec.supported())),
+                       "text/plain")
+        return
+    except codec.MalformedBody as e:
+        await _respond(send, 400, "{}\n".format(e), "text/plain")
+        return
+
+    accept = codec.negotiate(parse_accept_header(headers.get("accept"), MIMEAccept), content_type)
+
+    # Do the prediction off the event loop
+    with stage_metrics.time("predict"):
+        predictions = await asyncio.get_event_loop().run_in_executor(None, ScoringService.predict, data)
+    if request_log.sampled("/invocations"):
+        log.info("Invoked", extra={
+            "fields": {"records": data.shape[0], "content_type": content_type, "accept": accept},
+            "payloads": {"input": data, "predictions": predictions},
+        })
+    if ScoringService.row_cache is not None:
+        for name, value in ScoringService.row_cache.stats().items():
+            if name != "hit_rate":
+                stage_metrics.set("model_server_cache_" + name, value)
+
+    # Convert from numpy back to the requested format
+    with stage_metrics.time("encode"):
+        result = codec.encode(predictions, accept)
+
+    await _respond(send, 200, result, accept)
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def _respond(send, status, body, mimetype):
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", mimetype.encode("latin-1")),
+                    (b"content-length", str(len(body)).encode("latin-1"))],
+    })
+    await send({"type": "http.response.body", "body": body})
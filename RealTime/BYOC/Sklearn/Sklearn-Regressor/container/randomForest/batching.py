@@ -0,0 +1,134 @@
+# Dynamic micro-batching for the scoring service. Requests that arrive concurrently in the same
+# gunicorn worker are collected for up to a short window, scored with a single predict call on the
+# stacked rows, and the predictions are split back to each caller. Batching only helps when a worker
+# serves several requests at once, so serve switches to threaded workers when it is enabled.
+#
+# We set the following parameters:
+#
+# Parameter                Environment Variable              Default Value
+# ---------                --------------------              -------------
+# enable batching          MODEL_SERVER_BATCHING             false
+# max rows per batch       MODEL_SERVER_BATCH_MAX_SIZE       64
+# max wait per batch       MODEL_SERVER_BATCH_MAX_WAIT_MS    5 milliseconds
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+import pandas as pd
+
+
+def enabled():
+    """Return True if micro-batching was turned on through the environment."""
+    return os.environ.get("MODEL_SERVER_BATCHING", "false").lower() in ("1", "true", "yes")
+
+
+def from_env(predict_fn):
+    """Build a MicroBatcher around predict_fn from the environment, or None if batching is off."""
+    if not enabled():
+        return None
+    return MicroBatcher(
+        predict_fn,
+        max_batch_size=int(os.environ.get("MODEL_SERVER_BATCH_MAX_SIZE", 64)),
+        max_wait_ms=float(os.environ.get("MODEL_SERVER_BATCH_MAX_WAIT_MS", 5)),
+    )
+
+
+def _stack(inputs):
+    """Stack the per-request inputs into one frame the model can score in a single call."""
+    if all(isinstance(x, pd.DataFrame) for x in inputs):
+        columns = inputs[0].columns
+        if all(x.columns.equals(columns) for x in inputs[1:]):
+            return pd.concat(inputs, axis=0, ignore_index=True)
+        # Requests in different formats label the same columns differently, names from Arrow and
+        # integers from CSV, and concat would align them by label into NaN-filled columns. The model
+        # reads the columns by position, so stack the values.
+        return pd.DataFrame(np.concatenate([x.to_numpy() for x in inputs], axis=0))
+    return np.concatenate([np.asarray(x) for x in inputs], axis=0)
+
+
+class MicroBatcher(object):
+    """Collects concurrent predict calls into batches of at most max_batch_size rows.
+
+    The first request of a batch waits at most max_wait_ms for others to join. A request that is
+    larger than max_batch_size on its own is still scored in one call, it is never split.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=64, max_wait_ms=5.0):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_started(self):
+        # The worker thread is started lazily so that a batcher created before gunicorn forks gets
+        # its own thread in every worker process.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, data):
+        """Queue data for prediction and return a Future that resolves to its predictions."""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((data, future))
+        return future
+
+    def predict(self, data):
+        """Blocking equivalent of the wrapped predict_fn."""
+        return self.submit(data).result()
+
+    def _collect(self):
+        data, future = self._queue.get()
+        batch = [(data, future)]
+        rows = len(data)
+        deadline = time.monotonic() + self.max_wait
+        while rows < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                data, future = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append((data, future))
+            rows += len(data)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            inputs = [data for data, _ in batch]
+            try:
+                predictions = np.asarray(self.predict_fn(_stack(inputs)))
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                else:
+                    # One bad request, e.g. with the wrong number of columns, mustn't fail the requests
+                    # it happened to be batched with, so score each of them on its own
+                    self._score_each(batch)
+                continue
+
+            offset = 0
+            for data, future in batch:
+                future.set_result(predictions[offset:offset + len(data)])
+                offset += len(data)
+
+    def _score_each(self, batch):
+        for data, future in batch:
+            try:
+                future.set_result(np.asarray(self.predict_fn(data)))
+            except Exception as e:
+                future.set_exception(e)
@@ -0,0 +1,125 @@
+# Row-level prediction cache for the scoring service. Every input row is hashed, rows seen recently
+# are answered from a bounded LRU and only the misses are sent to the model, after which the
+# predictions are put back together in the original row order. Useful when the same feature rows are
+# scored over and over, e.g. the same item features requested on behalf of many users.
+#
+# We set the following parameters:
+#
+# Parameter                Environment Variable              Default Value
+# ---------                --------------------              -------------
+# max cached rows          MODEL_SERVER_CACHE_MAX_ENTRIES    0 (no limit on entries)
+# max cache size           MODEL_SERVER_CACHE_MAX_BYTES      0 (no limit on bytes)
+# time to live             MODEL_SERVER_CACHE_TTL            0 seconds (entries never expire)
+#
+# The cache is enabled when at least one of the two size limits is set. Each gunicorn worker has its
+# own cache.
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Rough per-entry cost of the OrderedDict node, key object and value object on top of the digest
+_ENTRY_OVERHEAD = 200
+_DIGEST_SIZE = 16
+
+
+def from_env():
+    """Build a PredictionCache from the environment, or None if no size limit was set."""
+    max_entries = int(os.environ.get("MODEL_SERVER_CACHE_MAX_ENTRIES", 0))
+    max_bytes = int(os.environ.get("MODEL_SERVER_CACHE_MAX_BYTES", 0))
+    if not max_entries and not max_bytes:
+        return None
+    return PredictionCache(max_entries=max_entries, max_bytes=max_bytes,
+                           ttl=float(os.environ.get("MODEL_SERVER_CACHE_TTL", 0)))
+
+
+class PredictionCache(object):
+    """LRU of predictions keyed by a hash of the input row, bounded by entries and/or bytes.
+
+    Rows are hashed from their float64 values, so the same features hit the same entry whichever
+    codec decoded them. Entries older than ttl seconds count as misses and are dropped when seen.
+    """
+
+    def __init__(self, max_entries=0, max_bytes=0, ttl=0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def predict(self, input, predict_fn):
+        """Predict input with predict_fn, answering the rows already in the cache without it."""
+        rows = np.ascontiguousarray(input, dtype=np.float64)
+        if rows.ndim == 1:
+            rows = rows.reshape(1, -1)
+        keys = [hashlib.blake2b(row, digest_size=_DIGEST_SIZE).digest() for row in rows]
+
+        results = [None] * len(keys)
+        misses = []
+        now = time.monotonic()
+        with self._lock:
+            for i, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is not None and self.ttl and entry[1] < now:
+                    self._remove(key)
+                    entry = None
+                if entry is None:
+                    misses.append(i)
+                else:
+                    self._entries.move_to_end(key)
+                    results[i] = entry[0]
+            self.hits += len(keys) - len(misses)
+            self.misses += len(misses)
+
+        if not misses:
+            return np.array(results)
+
+        if len(misses) == len(keys):
+            predictions = np.asarray(predict_fn(input))
+        elif isinstance(input, pd.DataFrame):
+            predictions = np.asarray(predict_fn(input.iloc[misses]))
+        else:
+            predictions = np.asarray(predict_fn(np.asarray(input)[misses]))
+
+        expires = now + self.ttl
+        with self._lock:
+            for i, prediction in zip(misses, predictions):
+                results[i] = prediction
+                self._put(keys[i], prediction, expires)
+        return np.array(results, dtype=predictions.dtype)
+
+    def _put(self, key, prediction, expires):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (prediction, expires)
+        self.bytes += _DIGEST_SIZE + prediction.nbytes + _ENTRY_OVERHEAD
+        while ((self.max_entries and len(self._entries) > self.max_entries) or
+               (self.max_bytes and self.bytes > self.max_bytes)):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        prediction, _ = self._entries.pop(key)
+        self.bytes -= _DIGEST_SIZE + prediction.nbytes + _ENTRY_OVERHEAD
+
+    def stats(self):
+        """Counters for sizing the cache: hits, misses, hit rate, evictions and current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": float(self.hits) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+            }
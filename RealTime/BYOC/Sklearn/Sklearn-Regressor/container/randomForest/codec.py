@@ -0,0 +1,190 @@
+# Request and response codecs for /invocations. Besides CSV the predictor accepts NumPy .npy and
+# Arrow IPC stream bodies, which are mapped straight onto the request bytes instead of going
+# through text parsing. The response format is picked from the Accept header, defaulting to the
+# format the request was sent in, and to CSV when the header names nothing this container can write.
+#
+# CSV requests go through pandas once, after which the worker remembers the column count and dtype
+# and parses bodies of that shape straight into an ndarray. Anything that doesn't fit the learned
+# shape falls back to pandas. Both parse every field to the same value: int64 for integer columns and
+# correctly rounded float64 otherwise, the dtypes pandas gives them.
+
+import io
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:
+    # Arrow support is optional, the container still serves CSV and NPY without it
+    pa = None
+
+# What a body that doesn't parse raises. pandas, numpy and Arrow use ValueError (pandas' ParserError,
+# ArrowInvalid and UnicodeDecodeError are all subclasses), a truncated Arrow stream an IOError.
+_decode_errors = (ValueError, EOFError, OSError)
+
+
+CSV = "text/csv"
+NPY = "application/x-npy"
+ARROW = "application/vnd.apache.arrow.stream"
+
+
+class UnsupportedContentType(ValueError):
+    """Raised when a request body or Accept header names a format this predictor can't handle."""
+
+
+class MalformedBody(ValueError):
+    """Raised when a request body can't be decoded in the format it was sent as."""
+
+
+class CsvSchema(object):
+    """Column count and dtype of the numeric CSV payloads seen by this worker.
+
+    The schema is learned from the first CSV request that pandas parses into all-numeric columns.
+    After that, bodies with exactly that many fields on every line are split and converted in one
+    numpy call, without building a DataFrame.
+    """
+
+    def __init__(self):
+        self.columns = None
+        self.dtype = None
+
+    def learn(self, frame):
+        """Record the shape of a frame parsed by pandas if it is entirely numeric."""
+        if self.columns is not None:
+            return
+        kinds = set(dtype.kind for dtype in frame.dtypes)
+        if not kinds or not kinds <= set("iuf"):
+            return
+        # The dtype pandas parses the fields to. A narrower one would change the values the model
+        # compares against its split thresholds, LightGBM compares in float64. Integer-only payloads
+        # stay integers, a later body with a decimal point fails to parse and goes through pandas.
+        self.dtype = np.int64 if kinds <= set("iu") else np.float64
+        self.columns = frame.shape[1]
+
+    def parse(self, text):
+        """Parse text into a 2-d array, or return None if it doesn't match the learned schema."""
+        if self.columns is None:
+            return None
+        lines = text.strip().splitlines()
+        separators = self.columns - 1
+        if not lines or any(line.count(",") != separators for line in lines):
+            return None
+        try:
+            values = np.array(",".join(lines).split(","), dtype=self.dtype)
+        except ValueError:
+            return None
+        return values.reshape(len(lines), self.columns)
+
+
+# Each gunicorn worker learns its own schema from the first CSV request it serves
+csv_schema = CsvSchema()
+
+
+def supported():
+    """The content types this container can decode and encode."""
+    types = [CSV, NPY]
+    if pa is not None:
+        types.append(ARROW)
+    return types
+
+
+def decode(body, content_type):
+    """Decode a request body into something the model can score.
+
+    Args:
+        body (bytes): The raw request body.
+        content_type (str): The request mimetype, without parameters.
+    Returns:
+        A 2-d numpy array, or a pandas DataFrame for CSV bodies that don't match the learned
+        schema. NPY arrays are read-only views of body, Arrow columns are viewed in place and only
+        copied once to build the matrix.
+    Raises:
+        UnsupportedContentType: content_type isn't one of supported().
+        MalformedBody: body isn't valid in its content type.
+    """
+    try:
+        return _decode(body, content_type)
+    except UnsupportedContentType:
+        raise
+    except _decode_errors as e:
+        raise MalformedBody("Could not decode the {} body: {}".format(content_type, e))
+
+
+def _decode(body, content_type):
+    if content_type == CSV:
+        text = body.decode("utf-8")
+        data = csv_schema.parse(text)
+        if data is None:
+            # round_trip parses floats correctly rounded, like numpy in CsvSchema.parse. The default
+            # parser is off by one unit in the last place for some values with many digits.
+            data = pd.read_csv(io.StringIO(text), header=None, float_precision="round_trip")
+            csv_schema.learn(data)
+        return data
+    if content_type == NPY:
+        return _decode_npy(body)
+    if content_type == ARROW and pa is not None:
+        return _decode_arrow(body)
+    raise UnsupportedContentType(content_type)
+
+
+def _decode_npy(body):
+    buf = io.BytesIO(body)
+    version = np.lib.format.read_magic(buf)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(buf)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(buf)
+    if dtype.hasobject:
+        raise UnsupportedContentType("object arrays are not accepted in .npy requests")
+
+    array = np.frombuffer(body, dtype=dtype, count=int(np.prod(shape)), offset=buf.tell())
+    array = array.reshape(shape, order="F" if fortran_order else "C")
+    if array.ndim == 1:
+        array = array.reshape(1, -1)
+    return array
+
+
+def _decode_arrow(body):
+    table = pa.ipc.open_stream(pa.py_buffer(body)).read_all()
+    columns = [column.to_numpy() for column in table.combine_chunks().columns]
+    return np.column_stack(columns)
+
+
+def negotiate(accept_mimetypes, content_type):
+    """Pick the response mimetype from the Accept header, preferring the request's own format.
+
+    Clients that only accept types this container can't write get CSV, as they did before the other
+    formats were added.
+    """
+    types = supported()
+    if not accept_mimetypes:
+        # No Accept header, answer in the request's format
+        return content_type if content_type in types else CSV
+    if content_type in types:
+        types.remove(content_type)
+        types.insert(0, content_type)
+    return accept_mimetypes.best_match(types) or CSV
+
+
+def encode(predictions, accept):
+    """Encode a 1-d array of predictions in the negotiated response format."""
+    if accept == CSV:
+        predictions = np.asarray(predictions)
+        if predictions.dtype.kind in "iuf" and not np.isnan(predictions).any():
+            # str() of numpy floats gives the same shortest round-trip digits pandas writes
+            return "\n".join(predictions.astype(str).tolist()) + "\n"
+        out = io.StringIO()
+        pd.DataFrame({"results": predictions}).to_csv(out, header=False, index=False)
+        return out.getvalue()
+    if accept == NPY:
+        out = io.BytesIO()
+        np.save(out, np.asarray(predictions), allow_pickle=False)
+        return out.getvalue()
+    if accept == ARROW and pa is not None:
+        table = pa.table({"results": np.asarray(predictions)})
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+    raise UnsupportedContentType(accept)
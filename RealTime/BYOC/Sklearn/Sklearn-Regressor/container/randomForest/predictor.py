@@ -1,16 +1,27 @@
 from __future__ import print_function
 
+import gc
 import io
 import json
 import os
 import pickle
 import signal
 import sys
+import threading
 import traceback
 
 import flask
 import pandas as pd
 
+import batching
+import cache
+import codec
+import forest
+import metrics
+import request_log
+import threads
+import warmup
+
 
 #All training, model, hyperparameter type artifacts are within this prefix
 #for a general structure visit following link: 
@@ -21,23 +32,124 @@ model_path = os.path.join(prefix, "model")
 
 class ScoringService(object):
     model = None  # Where we keep the model when it's loaded
+    compiled = None  # The model flattened by forest.compile, when MODEL_SERVER_COMPILED_TREES is set
+    batcher = None  # Micro-batching in front of score(), when MODEL_SERVER_BATCHING is set
+    row_cache = None  # Row-level prediction cache in front of everything, when a cache size is set
+    lock = threading.Lock()  # Keeps a request and the start-up thread from loading the model twice
+    nthread = threads.from_env()  # OpenMP threads the native predict may use in this worker
 
     @classmethod
     def get_model(rgrs):
         """Get the model object for this instance, loading it if it's not already loaded."""
         if rgrs.model == None:
-            with open(os.path.join(model_path, "rf-model.pkl"), "rb") as inp:
-                rgrs.model = pickle.load(inp)
+            with rgrs.lock:
+                if rgrs.model == None:
+                    with open(os.path.join(model_path, "rf-model.pkl"), "rb") as inp:
+                        rgrs.model = pickle.load(inp)
         return rgrs.model
 
+    @classmethod
+    def load(rgrs):
+        """Get the model and, with MODEL_SERVER_COMPILED_TREES, flatten it for this worker.
+
+        Checking the flattened model scores with the native predict, so like the warm-up this only ever
+        runs in the worker, never in a preloading master (see post_fork).
+        """
+        model = rgrs.get_model()
+        if forest.enabled() and rgrs.compiled is None:
+            try:
+                compiled = forest.compile(model)
+                forest.check(compiled, lambda X: rgrs.native_predict(model, X))
+                rgrs.compiled = compiled
+            except NotImplementedError as e:
+                print("Serving with the native predict: {}".format(e))
+            except Exception:
+                # e.g. a library version the converter doesn't know, the model is still served
+                print("Serving with the native predict, compiling the trees failed:")
+                traceback.print_exc()
+        return model
+
     @classmethod
     def predict(rgrs, input):
         """For the input, do the predictions and return them.
         Args:
             input (a pandas dataframe): The data on which to do the predictions. There will be
                 one prediction per row in the dataframe"""
+        if rgrs.row_cache is not None:
+            return rgrs.row_cache.predict(input, rgrs._predict)
+        return rgrs._predict(input)
+
+    @classmethod
+    def _predict(rgrs, input):
+        if rgrs.batcher is not None:
+            return rgrs.batcher.predict(input)
+        return rgrs.score(input)
+
+    @classmethod
+    def score(rgrs, input):
+        """Run the model itself on input, without going through the cache or the batcher."""
         rf = rgrs.get_model()
-        return rf.predict(input)
+        if rgrs.compiled is not None:
+            return rgrs.compiled.predict(input)
+        return rgrs.native_predict(rf, input)
+
+    @classmethod
+    def native_predict(rgrs, model, input):
+        # LightGBM is told how many OpenMP threads to use on every call, see post_fork
+        if type(model).__module__.split(".")[0] == "lightgbm":
+            return model.predict(input, num_threads=rgrs.nthread)
+        return model.predict(input)
+
+
+# Load the model and score a few warm-up batches before /ping reports healthy (see warmup.py)
+startup = warmup.from_env(model_path, ScoringService.load, ScoringService.score)
+
+# With MODEL_SERVER_PRELOAD gunicorn imports this module once in the master before forking the workers.
+# Loading the model here lets every worker share the master's copy of it copy-on-write. Freezing the gc
+# moves everything allocated so far out of the collector's reach, so collections in the workers don't
+# write to those pages and un-share them. Every worker then warms up on a thread of its own, started in
+# post_fork, while it already answers /ping, as it does without preloading.
+#
+# OpenMP's thread pool doesn't survive a fork: a worker forked from a master that has started one hangs
+# in its first parallel region. So the master never scores anything, and runs OpenMP on one thread so
+# loading the model doesn't start the pool either. serve starts it with OMP_NUM_THREADS=1, setting it
+# here as well covers a gunicorn started some other way: the OpenMP runtime only reads it when it is
+# loaded, with the model's library as the model is unpickled. The workers get their share of the cores
+# back in post_fork.
+if os.environ.get("MODEL_SERVER_PRELOAD", "false").lower() in ("1", "true", "yes"):
+    os.environ["OMP_NUM_THREADS"] = "1"
+    ScoringService.nthread = 1
+    try:
+        ScoringService.get_model()
+    except Exception:
+        # Every worker tries again in its start-up and reports the failure on /ping
+        print("Preloading the model failed:")
+        traceback.print_exc()
+    if hasattr(gc, "freeze"):
+        gc.freeze()
+else:
+    startup.start()
+
+
+
+
+def post_fork():
+    """Set up a worker forked from a master that preloaded this module, called from gunicorn.conf.py."""
+    ScoringService.nthread = threads.from_env()
+    startup.start()
+
+
+ScoringService.batcher = batching.from_env(ScoringService.score)
+ScoringService.row_cache = cache.from_env()
+
+# Latency of the decode, predict and encode stages of /invocations, plus the prediction cache counters
+# and size, summed over all gunicorn workers and served on /metrics
+stage_metrics = metrics.Registry("model_server_stage_latency_seconds", ["decode", "predict", "encode"],
+                                 counters=["model_server_cache_" + name for name in ("hits", "misses", "evictions")],
+                                 gauges=["model_server_cache_" + name for name in ("entries", "bytes")])
+
+
+log = request_log.get_logger("predictor")
 
 
 # The flask app for serving predictions
@@ -47,37 +159,53 @@ app = flask.Flask(__name__)
 @app.route("/ping", methods=["GET"])
 def ping():
     """Determine if the container is working and healthy. In this sample container, we declare
-    it healthy if we can load the model successfully."""
-    health = ScoringService.get_model() is not None  # You can insert a health check here
+    it healthy once the model has been loaded and warmed up."""
+    status = startup.ping_status()  # You can insert a health check here
 
-    status = 200 if health else 404
     return flask.Response(response="\n", status=status, mimetype="application/json")
 
 
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Stage latency histograms and cache counters of all workers in the Prometheus text format."""
+    return flask.Response(response=stage_metrics.render(), status=200, content_type="text/plain; version=0.0.4")
+
+
 @app.route("/invocations", methods=["POST"])
 def transformation():
     
     data = None
 
-    # Convert from CSV to pandas
-    if flask.request.content_type == "text/csv":
-        data = flask.request.data.decode("utf-8")
-        s = io.StringIO(data)
-        data = pd.read_csv(s, header=None)
-    else:
+    # Convert from CSV, NPY or Arrow to a frame the model can score
+    try:
+        with stage_metrics.time("decode"):
+            data = codec.decode(flask.request.get_data(), flask.request.mimetype)
+    except codec.UnsupportedContentType:
         return flask.Response(
-            response="This predictor only supports CSV data", status=415, mimetype="text/plain"
+            response="This predictor only supports {} data".format(", ".join(codec.supported())),
+            status=415, mimetype="text/plain"
         )
+    except codec.MalformedBody as e:
+        return flask.Response(response="{}\n".format(e), status=400, mimetype="text/plain")
 
-    print("Invoked with {} records".format(data.shape[0]))
+    accept = codec.negotiate(flask.request.accept_mimetypes, flask.request.mimetype)
 
     # Do the prediction
-    predictions = ScoringService.predict(data)
-
-    # Convert from numpy back to CSV
-    out = io.StringIO()
-    pd.DataFrame({"results": predictions}).to_csv(out, header=False, index=False)
-    result = out.getvalue()
+    with stage_metrics.time("predict"):
+        predictions = ScoringService.predict(data)
+    if request_log.sampled("/invocations"):
+        log.info("Invoked", extra={
+            "fields": {"records": data.shape[0], "content_type": flask.request.mimetype, "accept": accept},
+            "payloads": {"input": data, "predictions": predictions},
+        })
+    if ScoringService.row_cache is not None:
+        for name, value in ScoringService.row_cache.stats().items():
+            if name != "hit_rate":
+                stage_metrics.set("model_server_cache_" + name, value)
+
+    # Convert from numpy back to the requested format
+    with stage_metrics.time("encode"):
+        result = codec.encode(predictions, accept)
     
     
-    return flask.Response(response=result, status=200, mimetype="text/csv")
+    return flask.Response(response=result, status=200, mimetype=accept)
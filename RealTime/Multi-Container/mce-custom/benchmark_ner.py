@@ -0,0 +1,91 @@
+# Throughput of the spaCy NER container for one document per call vs batches of documents through
+# nlp.pipe, the way container-spacy/NER/predictor.py scores a list input.
+#
+# Each line of the corpus is one document. Without --corpus a corpus of short news-like sentences is
+# generated. The first table sends the corpus as requests of 1, 10, 100 and 1000 documents (one
+# document per request is the old single-string endpoint), the second varies the nlp.pipe batch size
+# and number of processes for a single request holding the whole corpus.
+#
+# Usage: python benchmark_ner.py [--model en_core_web_sm] [--corpus docs.txt] [--docs 5000]
+
+import argparse
+import multiprocessing
+import random
+import time
+
+import spacy
+
+FIRST = ["Maria", "John", "Wei", "Aisha", "Carlos", "Olga", "Kenji", "Fatima", "Liam", "Priya"]
+LAST = ["Garcia", "Smith", "Zhang", "Khan", "Silva", "Ivanova", "Tanaka", "Ali", "Murphy", "Patel"]
+ORGS = ["Amazon", "the United Nations", "Siemens", "Toyota", "the World Bank", "Microsoft", "Nestle"]
+PLACES = ["Seattle", "Berlin", "Tokyo", "Nairobi", "Sao Paulo", "Mumbai", "Paris", "Toronto"]
+TEMPLATES = [
+    "{person} met executives from {org} in {place} on Monday to discuss a $2 billion deal.",
+    "{org} said {person} will lead its new office in {place} starting in March.",
+    "After three years in {place}, {person} left {org} to start a company of her own.",
+    "Shares of {org} rose 4% on Tuesday after {person} spoke at a conference in {place}.",
+]
+
+
+def generate_corpus(docs, seed=0):
+    rng = random.Random(seed)
+    return [rng.choice(TEMPLATES).format(person="{} {}".format(rng.choice(FIRST), rng.choice(LAST)),
+                                         org=rng.choice(ORGS), place=rng.choice(PLACES))
+            for _ in range(docs)]
+
+
+def entities(doc):
+    return [(X.text, X.label_) for X in doc.ents]
+
+
+def run_requests(nlp, corpus, docs_per_request, batch_size):
+    """Score the corpus as requests of docs_per_request documents, return docs/sec."""
+    start = time.perf_counter()
+    for i in range(0, len(corpus), docs_per_request):
+        texts = corpus[i:i + docs_per_request]
+        if docs_per_request == 1:
+            entities(nlp(texts[0]))
+        else:
+            [entities(doc) for doc in nlp.pipe(texts, batch_size=batch_size)]
+    return len(corpus) / (time.perf_counter() - start)
+
+
+def run_pipe(nlp, corpus, batch_size, n_process):
+    start = time.perf_counter()
+    [entities(doc) for doc in nlp.pipe(corpus, batch_size=batch_size, n_process=n_process)]
+    return len(corpus) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="en_core_web_sm", help="spaCy package name or path")
+    parser.add_argument("--corpus", help="text file with one document per line")
+    parser.add_argument("--docs", type=int, default=5000, help="size of the generated corpus")
+    parser.add_argument("--batch-size", type=int, default=256)
+    args = parser.parse_args()
+
+    nlp = spacy.load(args.model)
+    if args.corpus:
+        with open(args.corpus) as f:
+            corpus = [line.strip() for line in f if line.strip()]
+    else:
+        corpus = generate_corpus(args.docs)
+    # Let the first calls load whatever the pipeline loads lazily before timing anything
+    list(nlp.pipe(corpus[:100]))
+
+    print("model={} docs={} pipeline={}".format(args.model, len(corpus), nlp.pipe_names))
+    print("{:<20}{:>12}{:>14}".format("docs/request", "batch_size", "docs/s"))
+    for docs_per_request in (1, 10, 100, 1000):
+        print("{:<20}{:>12}{:>14.0f}".format(
+            docs_per_request, args.batch_size, run_requests(nlp, corpus, docs_per_request, args.batch_size)))
+
+    print()
+    print("{:<20}{:>12}{:>14}".format("n_process", "batch_size", "docs/s"))
+    processes = sorted(set([1, 2, multiprocessing.cpu_count()]))
+    for n_process in processes:
+        for batch_size in (16, 64, 256, 1000):
+            print("{:<20}{:>12}{:>14.0f}".format(n_process, batch_size, run_pipe(nlp, corpus, batch_size, n_process)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# Throughput of the TextBlob sentiment container's compiled index (container-textblob/Sentiment/
+# sentiment_index.py) against TextBlob(text).sentiment, which the container used to call per request.
+#
+# Each line of the corpus is one text. Without --corpus a corpus of short reviews with intensifiers,
+# negations, exclamation marks and emoticons is generated. The corpus is first scored both ways to check
+# the scores are identical, then sent as requests of 1, 10, 100 and 1000 texts to the index.
+#
+# Usage: python benchmark_sentiment.py [--corpus texts.txt] [--docs 20000]
+
+import argparse
+import os
+import random
+import sys
+import time
+
+from textblob import TextBlob
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "container-textblob", "Sentiment"))
+from sentiment_index import SentimentIndex  # noqa: E402
+
+SUBJECTS = ["The movie", "This phone", "The service", "Our hotel room", "The new album", "Dinner"]
+MODIFIERS = ["", "", "very ", "really ", "extremely ", "not ", "not very ", "never ", "terribly "]
+OPINIONS = ["good", "bad", "great", "awful", "boring", "beautiful", "disappointing", "nice", "slow",
+            "amazing", "cheap", "helpful", "rude", "funny"]
+ENDINGS = [".", ".", "!", "!!", " :)", " :(", " (!)", "... I don't know.", ", but the staff was friendly."]
+
+
+def generate_corpus(docs, seed=0):
+    rng = random.Random(seed)
+    return ["{} was {}{}{}".format(rng.choice(SUBJECTS), rng.choice(MODIFIERS), rng.choice(OPINIONS),
+                                   rng.choice(ENDINGS)) for _ in range(docs)]
+
+
+def run_textblob(corpus):
+    start = time.perf_counter()
+    for text in corpus:
+        TextBlob(text).sentiment
+    return len(corpus) / (time.perf_counter() - start)
+
+
+def run_index(index, corpus, docs_per_request):
+    start = time.perf_counter()
+    for i in range(0, len(corpus), docs_per_request):
+        index.score(corpus[i:i + docs_per_request])
+    return len(corpus) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", help="text file with one text per line")
+    parser.add_argument("--docs", type=int, default=20000, help="size of the generated corpus")
+    args = parser.parse_args()
+
+    if args.corpus:
+        with open(args.corpus) as f:
+            corpus = [line.strip() for line in f if line.strip()]
+    else:
+        corpus = generate_corpus(args.docs)
+
+    start = time.perf_counter()
+    index = SentimentIndex()
+    print("Compiled {} words in {:.3f}s".format(len(index.words), time.perf_counter() - start))
+
+    polarity, subjectivity = index.score(corpus)
+    differ = sum((p, s) != tuple(TextBlob(text).sentiment) for text, p, s in zip(corpus, polarity, subjectivity))
+    print("{} of {} texts score differently from TextBlob".format(differ, len(corpus)))
+
+    print("{:<20}{:>14}".format("docs/request", "docs/s"))
+    print("{:<20}{:>14.0f}".format("TextBlob", run_textblob(corpus)))
+    for docs_per_request in (1, 10, 100, 1000):
+        print("{:<20}{:>14.0f}".format(docs_per_request, run_index(index, corpus, docs_per_request)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# Memory and latency of the mce-custom endpoint as two containers against the single-process router in
+# container-router, for a client that needs both the entities and the sentiment of its texts.
+#
+# Each layout runs in processes of its own, the way the containers run one gunicorn worker each, and is
+# called through its flask app, so JSON parsing and serialization are included but not the network.
+# With two containers the client sends every payload to each of them; the sequential latency is the sum
+# of the two calls and the parallel latency the slower one. The router gets the payload once, for the
+# target "both", and its response is checked against the two containers' responses.
+#
+# Usage: python compare_router.py [--corpus docs.txt] [--requests 500] [--docs-per-request 1]
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+NER = os.path.join(HERE, "container-spacy", "NER")
+SENTIMENT = os.path.join(HERE, "container-textblob", "Sentiment")
+ROUTER = os.path.join(HERE, "container-router", "Router")
+
+
+def memory():
+    """The resident and peak resident memory of this process in MB."""
+    fields = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            fields[key] = value.strip()
+    return int(fields["VmRSS"].split()[0]) / 1024, int(fields["VmHWM"].split()[0]) / 1024
+
+
+def run(directory, module, payloads, headers):
+    """Load directory/module.py and post every payload to its /invocations.
+
+    Returns:
+        (float, float, float, list, list): The seconds it took to import, the resident and peak resident
+            memory in MB afterwards, the seconds per request and the parsed responses.
+    """
+    sys.path.insert(0, directory)
+    start = time.perf_counter()
+    app = __import__(module).app
+    startup = time.perf_counter() - start
+    client = app.test_client()
+    for payload in payloads[:10]:
+        client.post("/invocations", data=payload, content_type="application/json", headers=headers)
+
+    latencies = []
+    responses = []
+    for payload in payloads:
+        start = time.perf_counter()
+        response = client.post("/invocations", data=payload, content_type="application/json", headers=headers)
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise RuntimeError("{} returned {}: {}".format(module, response.status_code, response.get_data()[:500]))
+        responses.append(json.loads(response.get_data()))
+    rss, peak = memory()
+    return startup, rss, peak, latencies, responses
+
+
+def measure(directory, module, payloads, headers=None):
+    # A fresh interpreter for every process, so it only holds what its layout loads
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(run, directory, module, payloads, headers or {}).result()
+
+
+def describe(name, startup, rss, peak, latencies):
+    latencies = np.array(latencies) * 1000
+    print("{:<28}{:>10.2f}{:>10.0f}{:>10.0f}{:>10.2f}{:>10.2f}".format(
+        name, startup, rss, peak, np.percentile(latencies, 50), np.percentile(latencies, 99)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", help="text file with one document per line")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--docs-per-request", type=int, default=1)
+    args = parser.parse_args()
+
+    # Imported here rather than at the top, where the spawned processes would import spaCy as well
+    from benchmark_ner import generate_corpus
+    if args.corpus:
+        with open(args.corpus) as f:
+            corpus = [line.strip() for line in f if line.strip()]
+    else:
+        corpus = generate_corpus(args.requests * args.docs_per_request)
+    payloads = []
+    for i in range(args.requests):
+        texts = corpus[(i * args.docs_per_request) % len(corpus):][:args.docs_per_request]
+        payloads.append(json.dumps({"input": texts if args.docs_per_request > 1 else texts[0]}))
+
+    # The router loads the predictors from this checkout rather than from /opt/program
+    os.environ["MODEL_SERVER_NER_DIR"] = NER
+    os.environ["MODEL_SERVER_SENTIMENT_DIR"] = SENTIMENT
+
+    ner = measure(NER, "predictor", payloads)
+    sentiment = measure(SENTIMENT, "predictor", payloads)
+    router = measure(ROUTER, "router", payloads, {"X-Amzn-SageMaker-Target-Container-Hostname": "both"})
+
+    print("{} requests of {} docs".format(len(payloads), args.docs_per_request))
+    print("{:<28}{:>10}{:>10}{:>10}{:>10}{:>10}".format("layout", "startup s", "RSS MB", "peak MB", "p50 ms",
+                                                       "p99 ms"))
+    describe("spacyContainer", *ner[:4])
+    describe("textblobContainer", *sentiment[:4])
+    describe("two containers, sequential", ner[0] + sentiment[0], ner[1] + sentiment[1], ner[2] + sentiment[2],
+             np.add(ner[3], sentiment[3]))
+    describe("two containers, parallel", max(ner[0], sentiment[0]), ner[1] + sentiment[1], ner[2] + sentiment[2],
+             np.maximum(ner[3], sentiment[3]))
+    describe("router, both", *router[:4])
+
+    differ = sum(response != {"spacyContainer": a, "textblobContainer": b}
+                 for response, a, b in zip(router[4], ner[4], sentiment[4]))
+    print("{} of {} router responses differ from the two containers'".format(differ, len(payloads)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# Both predictors of the mce-custom example, container-spacy/NER and container-textblob/Sentiment, in
+# one process behind one flask app.
+#
+# SageMaker's direct invocation mode sends a request to the container named by TargetContainerHostname
+# and tells it which one in the X-Amzn-SageMaker-Target-Container-Hostname header. The router dispatches
+# on the same header, so clients written for the two-container endpoint work unchanged against a
+# single-container endpoint running this image: a request for spacyContainer or textblobContainer gets
+# exactly the response that container would have sent. An endpoint with a single container can't be
+# given a TargetContainerHostname, so the target can also be passed as CustomAttributes="target=<name>",
+# which reaches the container as X-Amzn-SageMaker-Custom-Attributes.
+#
+# The target "both" runs the two models on one request: the body is parsed once and the same texts go
+# to both, and the response holds each container's response under its hostname:
+#
+#   {"spacyContainer": {"output": [...]}, "textblobContainer": {"Polarity": ..., "Subjectivity": ...}}
+#
+# Each model still tokenizes with its own tokenizer, since the sentiment scores are defined on
+# TextBlob's tokens and the entities on spaCy's.
+#
+# We set the following parameters:
+#
+# Parameter                Environment Variable              Default Value
+# ---------                --------------------              -------------
+# NER hostname             MODEL_SERVER_NER_HOSTNAME         spacyContainer
+# sentiment hostname       MODEL_SERVER_SENTIMENT_HOSTNAME   textblobContainer
+# hostname for both        MODEL_SERVER_BOTH_HOSTNAME        both
+# target without a header  MODEL_SERVER_DEFAULT_TARGET       both
+# NER predictor directory  MODEL_SERVER_NER_DIR              NER next to this file
+# sentiment predictor      MODEL_SERVER_SENTIMENT_DIR        Sentiment next to this file
+# directory
+
+import importlib.util
+import json
+import os
+import sys
+
+import flask
+from flask import Flask
+
+import request_log
+
+log = request_log.get_logger("router")
+
+here = os.path.dirname(os.path.abspath(__file__))
+ner_hostname = os.environ.get('MODEL_SERVER_NER_HOSTNAME', 'spacyContainer')
+sentiment_hostname = os.environ.get('MODEL_SERVER_SENTIMENT_HOSTNAME', 'textblobContainer')
+both_hostname = os.environ.get('MODEL_SERVER_BOTH_HOSTNAME', 'both')
+default_target = os.environ.get('MODEL_SERVER_DEFAULT_TARGET', both_hostname)
+
+
+def load_predictor(name, directory):
+    """Import directory/predictor.py as the module name, with directory on the path for its imports."""
+    if directory not in sys.path:
+        sys.path.append(directory)
+    spec = importlib.util.spec_from_file_location(name, os.path.join(directory, 'predictor.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+# Load both models once, at import
+ner = load_predictor('ner_predictor', os.environ.get('MODEL_SERVER_NER_DIR', os.path.join(here, 'NER')))
+sentiment = load_predictor('sentiment_predictor',
+                           os.environ.get('MODEL_SERVER_SENTIMENT_DIR', os.path.join(here, 'Sentiment')))
+
+
+def target(headers):
+    """The hostname a request is for, from its headers."""
+    hostname = headers.get('X-Amzn-SageMaker-Target-Container-Hostname')
+    if hostname:
+        return hostname
+    for attribute in headers.get('X-Amzn-SageMaker-Custom-Attributes', '').split(','):
+        key, _, value = attribute.partition('=')
+        if key.strip() == 'target' and value.strip():
+            return value.strip()
+    return default_target
+
+
+# The flask app for serving predictions
+app = Flask(__name__)
+@app.route('/ping', methods=['GET'])
+def ping():
+    # Healthy when both predictors are
+    health = ner.ping().status_code == 200 and sentiment.ping().status_code == 200
+    status = 200 if health else 404
+    return flask.Response(response= '\n', status=status, mimetype='application/json')
+
+
+@app.route('/invocations', methods=['POST'])
+def transformation():
+    hostname = target(flask.request.headers)
+
+    # A single target is served by that predictor's own view, so the response is the same as from its
+    # container
+    if hostname == ner_hostname:
+        return ner.transformation()
+    if hostname == sentiment_hostname:
+        return sentiment.transformation()
+    if hostname != both_hostname:
+        return flask.Response(response='Unknown target container {}, expected one of {}'.format(
+            hostname, ', '.join([ner_hostname, sentiment_hostname, both_hostname])), status=400,
+            mimetype='text/plain')
+
+    #Process input once for both models
+    input_json = flask.request.get_json()
+    resp = input_json['input']
+
+    result = {
+        ner_hostname: ner.respond(resp),
+        sentiment_hostname: sentiment.respond(resp),
+        }
+    if request_log.sampled("/invocations"):
+        log.info("Invoked", extra={"fields": {"target": hostname}, "payloads": {"input": resp, "result": result}})
+
+    resultjson = json.dumps(result)
+    return flask.Response(response=resultjson, status=200, mimetype='application/json')
@@ -0,0 +1,6 @@
+import router as myapp
+
+# This is just a simple wrapper for gunicorn to find your app.
+# The router loads the NER and Sentiment predictors from the directories next to it.
+
+app = myapp.app
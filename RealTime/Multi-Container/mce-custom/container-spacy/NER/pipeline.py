@@ -0,0 +1,156 @@
+# Loading and profiling of the spaCy pipeline behind the NER predictor.
+#
+# The predictor only reads doc.ents, but the packaged pipelines also run a tagger, parser, lemmatizer
+# and so on. With MODEL_SERVER_NLP_PRUNE the pipeline is loaded without the components the ones in
+# MODEL_SERVER_NLP_COMPONENTS don't depend on. The dependencies are worked out from the model's
+# config.cfg before anything is loaded: a component is kept if it assigns an attribute a kept
+# component requires, or if a kept component listens to it (a shared tok2vec or transformer).
+#
+# One dependency isn't declared anywhere: the entity recognizer doesn't start an entity across a
+# sentence boundary, and those are set by the parser. Without the parser an entity can occasionally run
+# over the end of a sentence. Pipelines that ship a (disabled) senter can keep sentence boundaries at a
+# fraction of the parser's cost with MODEL_SERVER_NLP_COMPONENTS=ner,senter, which also enables it.
+#
+# With MODEL_SERVER_NLP_PROFILE every request runs the pipeline one component at a time and logs how
+# long each one took, which shows what pruning would save.
+#
+# We set the following parameters:
+#
+# Parameter                Environment Variable              Default Value
+# ---------                --------------------              -------------
+# prune the pipeline       MODEL_SERVER_NLP_PRUNE            false
+# components to serve      MODEL_SERVER_NLP_COMPONENTS       ner
+# per-component timings    MODEL_SERVER_NLP_PROFILE          false
+
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import spacy
+from spacy.language import Language
+
+_TRUE = ("1", "true", "yes")
+
+
+def profiling():
+    """Return True if per-component profiling was turned on through the environment."""
+    return os.environ.get("MODEL_SERVER_NLP_PROFILE", "false").lower() in _TRUE
+
+
+def load(name, prune=None, components=None):
+    """Load the pipeline name, a package name or path, keeping only what components need if prune.
+
+    prune and components default to MODEL_SERVER_NLP_PRUNE and MODEL_SERVER_NLP_COMPONENTS.
+    """
+    if prune is None:
+        prune = os.environ.get("MODEL_SERVER_NLP_PRUNE", "false").lower() in _TRUE
+    if components is None:
+        components = os.environ.get("MODEL_SERVER_NLP_COMPONENTS", "ner").split(",")
+    components = [c.strip() for c in components if c.strip()]
+
+    start = time.perf_counter()
+    exclude = []
+    if prune:
+        config = spacy.util.load_config(_config_path(name))
+        keep = required_components(config, components)
+        exclude = [c for c in config["nlp"]["pipeline"] if c not in keep]
+    nlp = spacy.load(name, exclude=exclude)
+    for c in components:
+        if c in nlp.disabled:
+            nlp.enable_pipe(c)
+    print("Loaded {} in {:.3f}s with components {}{}".format(
+        name, time.perf_counter() - start, nlp.pipe_names, ", excluded {}".format(exclude) if exclude else ""))
+    return nlp
+
+
+def _config_path(name):
+    if spacy.util.is_package(name):
+        path = spacy.util.get_package_path(name)
+    else:
+        path = Path(name)
+    if (path / "config.cfg").exists():
+        return path / "config.cfg"
+    # Installed packages keep the pipeline in a <lang>_<name>-<version> directory inside the package
+    for config in sorted(path.glob("*/config.cfg")):
+        return config
+    # An OSError, like the one spacy.load raises for a pipeline it can't find
+    raise OSError("Can't find the spaCy pipeline {}: it isn't an installed package and there is no config.cfg "
+                  "in {}".format(name, path.resolve()))
+
+
+def required_components(config, targets):
+    """The components of the pipeline in config that the target components depend on, and the targets.
+
+    Args:
+        config (Config): The pipeline's config.cfg.
+        targets (list of str): The components whose output is used.
+    Returns:
+        list of str: The components to keep, in pipeline order. Components whose dependencies can't
+            be worked out, e.g. ones sourced from another pipeline, are always kept.
+    """
+    # Makes sure spaCy's built-in factories, and their meta data, are registered
+    spacy.blank(config["nlp"]["lang"])
+
+    pipeline = list(config["nlp"]["pipeline"])
+    settings = config["components"]
+    factories = dict((c, settings[c].get("factory")) for c in pipeline)
+    keep = set(c for c in pipeline if c in targets or not factories[c] or not Language.has_factory(factories[c]))
+
+    while True:
+        requires = set()
+        upstream = set()
+        for c in keep:
+            if factories[c] and Language.has_factory(factories[c]):
+                requires.update(Language.get_factory_meta(factories[c]).requires)
+            upstream.update(_listened_to(settings[c]))
+        needed = set()
+        for c in pipeline:
+            if c in keep:
+                continue
+            assigns = set(Language.get_factory_meta(factories[c]).assigns)
+            if assigns & requires or c in upstream or ("*" in upstream and factories[c] in ("tok2vec", "transformer")):
+                needed.add(c)
+        if not needed:
+            return [c for c in pipeline if c in keep]
+        keep |= needed
+
+
+def _listened_to(settings):
+    """Names of the components a component's model listens to, "*" for any tok2vec or transformer."""
+    names = set()
+    if isinstance(settings, dict):
+        architecture = settings.get("@architectures", "")
+        if "Listener" in architecture and "upstream" in settings:
+            names.add(settings["upstream"])
+        for value in settings.values():
+            names |= _listened_to(value)
+    return names
+
+
+def profiled_pipe(nlp, texts, batch_size=256):
+    """Run texts through nlp one component at a time.
+
+    Returns:
+        (list of Doc, OrderedDict): The processed docs, and the seconds spent in the tokenizer and
+            each pipeline component.
+    """
+    timings = OrderedDict()
+    start = time.perf_counter()
+    docs = [nlp.make_doc(text) for text in texts]
+    timings["tokenizer"] = time.perf_counter() - start
+    for name, proc in nlp.pipeline:
+        start = time.perf_counter()
+        if hasattr(proc, "pipe"):
+            docs = list(proc.pipe(docs, batch_size=batch_size))
+        else:
+            docs = [proc(doc) for doc in docs]
+        timings[name] = time.perf_counter() - start
+    return docs, timings
+
+
+def format_profile(timings, docs):
+    total = sum(timings.values())
+    return "Pipeline profile for {} docs, {:.2f}ms: {}".format(docs, total * 1000, ", ".join(
+        "{} {:.2f}ms ({:.0%})".format(name, seconds * 1000, seconds / total if total else 0)
+        for name, seconds in timings.items()))
@@ -3,8 +3,25 @@ import flask
 import os
 import json
 import logging
-from textblob import TextBlob
 
+import request_log
+from sentiment_index import SentimentIndex
+
+log = request_log.get_logger("predictor")
+
+# Compile TextBlob's sentiment lexicon once at startup, it scores the same as TextBlob(text).sentiment
+index = SentimentIndex()
+
+
+def respond(resp):
+    """The response for the input of a request, one text or a list of them."""
+    # A list of results for a list input
+    texts = resp if isinstance(resp, list) else [resp]
+    polarity, subjectivity = index.score(texts)
+    result = [{"Polarity": p, "Subjectivity": s} for p, s in zip(polarity, subjectivity)]
+    if not isinstance(resp, list):
+        result = result[0]
+    return result
 
 
 # The flask app for serving predictions
@@ -12,7 +29,7 @@ app = Flask(__name__)
 @app.route('/ping', methods=['GET'])
 def ping():
     # Check if the classifier was loaded correctly
-    health = TextBlob is not None
+    health = index is not None
     status = 200 if health else 404
     return flask.Response(response= '\n', status=status, mimetype='application/json')
 
@@ -20,20 +37,14 @@ def ping():
 @app.route('/invocations', methods=['POST'])
 def transformation():
     
-    #Process input
+    #Process input, either one text or a list of them
     input_json = flask.request.get_json()
     resp = input_json['input']
     
     #Sentiment Analysis
-    sent = TextBlob(resp).sentiment
-    polarity, subjectivity = sent[0], sent[1]
-    print(polarity)
-    print(type(polarity))
-    print(subjectivity)
-    print(type(subjectivity))
-    result = {"Polarity": polarity, "Subjectivity": subjectivity}
-    print(result)
-    print(type(result))
+    result = respond(resp)
+    if request_log.sampled("/invocations"):
+        log.info("Invoked", extra={"payloads": {"input": resp, "result": result}})
 
     resultjson = json.dumps(result)
     return flask.Response(response=resultjson, status=200, mimetype='application/json')
\ No newline at end of file
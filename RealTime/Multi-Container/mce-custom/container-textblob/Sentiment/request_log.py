@@ -0,0 +1,172 @@
+# Logging for the request path of the predictors. Records are put on a bounded in-memory queue and
+# written to stdout as JSON lines by a background thread, so a request never waits on the log stream.
+# When the writer falls behind, records are dropped rather than queued without limit, and the number
+# dropped is logged once it catches up.
+#
+# Each route has a sampling rate, so high-volume routes can log e.g. one request in a hundred.
+# Payloads are passed as extra={"payloads": {...}} and only ever logged as previews of a bounded size.
+# They are off by default: turning an array or a frame into text costs far more than the rest of the
+# record, so only a share of the logged records keep theirs (warnings and errors always do). The
+# previews are made by the writer thread, which holds a reference to the payloads until then, so they
+# mustn't be changed after they are logged.
+#
+# We set the following parameters:
+#
+# Parameter                Environment Variable              Default Value
+# ---------                --------------------              -------------
+# log level                MODEL_SERVER_LOG_LEVEL            INFO
+# sampling rate per route  MODEL_SERVER_LOG_SAMPLE_RATES     1 for every route, e.g.
+#                                                            "/invocations=0.01,/ping=0"
+# share of logged records MODEL_SERVER_LOG_PAYLOAD_RATE     0, e.g. 0.01 for one in a hundred
+# with payload previews
+# payload preview size     MODEL_SERVER_LOG_PREVIEW_CHARS    200 characters
+# records waiting to be    MODEL_SERVER_LOG_QUEUE_SIZE       10000
+# written
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+level = os.environ.get("MODEL_SERVER_LOG_LEVEL", "INFO").upper()
+payload_rate = float(os.environ.get("MODEL_SERVER_LOG_PAYLOAD_RATE", 0))
+preview_chars = int(os.environ.get("MODEL_SERVER_LOG_PREVIEW_CHARS", 200))
+queue_size = int(os.environ.get("MODEL_SERVER_LOG_QUEUE_SIZE", 10000))
+
+
+def _parse_rates(value):
+    rates = {}
+    for item in value.split(","):
+        if "=" in item:
+            route, rate = item.split("=", 1)
+            rates[route.strip()] = float(rate)
+    return rates
+
+
+sample_rates = _parse_rates(os.environ.get("MODEL_SERVER_LOG_SAMPLE_RATES", ""))
+
+
+def _sample(rate):
+    return rate >= 1.0 or (rate > 0 and random.random() < rate)
+
+
+def sampled(route):
+    """Return True if this request on route should be logged, according to its sampling rate."""
+    return _sample(sample_rates.get(route, 1.0))
+
+
+def preview(value, limit=None):
+    """A str of value cut down to at most limit characters (MODEL_SERVER_LOG_PREVIEW_CHARS).
+
+    Arrays and frames are sliced to their first rows before they are turned into text, so the
+    cost doesn't grow with the payload, and the preview says how big the whole value was.
+    """
+    if limit is None:
+        limit = preview_chars
+    shape = getattr(value, "shape", None)
+    if shape is not None and len(shape) > 0:
+        head = value[:5] if not hasattr(value, "iloc") else value.iloc[:5]
+        text = "{} {}: {}".format(type(value).__name__, tuple(shape), head)
+    elif isinstance(value, (bytes, bytearray)):
+        text = "{} bytes: {!r}".format(len(value), bytes(value[:limit]))
+    elif isinstance(value, (list, tuple)) and len(value) > 5:
+        text = "{} of {}: {}".format(type(value).__name__, len(value), value[:5])
+    else:
+        text = str(value)
+    if len(text) > limit:
+        text = "{}... ({} chars)".format(text[:limit], len(text))
+    return text
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record with the time, level, logger, message, any extra fields and previews
+    of any payloads."""
+
+    def format(self, record):
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + ".%03dZ" % record.msecs,
+            "level": record.levelname,
+            "logger": record.name,
+            "pid": record.process,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        for name, value in getattr(record, "payloads", {}).items():
+            entry[name] = preview(value)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records when the queue is full, with one writer thread per process."""
+
+    def __init__(self):
+        logging.handlers.QueueHandler.__init__(self, queue.Queue(queue_size))
+        self.dropped = 0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        # A writer thread started in the gunicorn master doesn't survive the fork, so every worker
+        # starts its own the first time it logs
+        with self._lock:
+            if self._pid != os.getpid():
+                self.queue = queue.Queue(queue_size)
+                stream = logging.StreamHandler(sys.stdout)
+                stream.setFormatter(JsonFormatter())
+                listener = logging.handlers.QueueListener(self.queue, stream)
+                listener.start()
+                atexit.register(listener.stop)
+                self._pid = os.getpid()
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            self._start()
+        logging.handlers.QueueHandler.emit(self, record)
+
+    def prepare(self, record):
+        # The formatting happens on the writer thread, only the traceback is rendered here since it
+        # refers to the frames of this thread. Payloads the record doesn't keep are let go of here.
+        if getattr(record, "payloads", None) and record.levelno < logging.WARNING and not _sample(payload_rate):
+            record.payloads = {}
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            try:
+                self.queue.put_nowait(logging.LogRecord(
+                    __name__, logging.WARNING, __file__, 0, "Dropped %d log records, the log writer fell behind",
+                    (dropped,), None))
+            except queue.Full:
+                self.dropped += dropped
+
+
+_handler = _QueueHandler()
+
+
+def get_logger(name):
+    """A logger that writes through the queue, pass structured fields as extra={"fields": {...}}."""
+    logger = logging.getLogger(name)
+    if _handler not in logger.handlers:
+        logger.addHandler(_handler)
+        logger.setLevel(level)
+        logger.propagate = False
+    return logger
@@ -0,0 +1,111 @@
+# Sentiment scoring with the lexicon of TextBlob's PatternAnalyzer compiled into a flat index.
+#
+# TextBlob(text).sentiment looks every word up in a lazily loaded dict of part-of-speech dicts, builds
+# a dict per assessed word, scans all emoticon sets for every token with punctuation in it and creates
+# its result namedtuple class on every call. SentimentIndex does the same work from tables built once
+# at startup:
+#
+#   words       word -> (polarity, subjectivity, intensity, whether it modifies the next word), the
+#               averages over all parts of speech TextBlob uses when it has no tags
+#   negations   "no", "not", "n't", "never"
+#   emoticons   lowercased emoticon -> polarity
+#
+# A batch of texts is tokenized with TextBlob's own tokenizer and run through the same rules for
+# intensifiers ("very good"), negations ("not good") and exclamation marks, and the per-text averages
+# are taken in one np.bincount over the assessments of the whole batch. The sums are added up in the
+# same order as TextBlob adds them, so the scores are identical to TextBlob's, not just close.
+
+import numpy as np
+from textblob import _text
+from textblob.en import sentiment as pattern_sentiment
+
+
+class SentimentIndex(object):
+    def __init__(self, sentiment=pattern_sentiment):
+        self.tokenizer = sentiment.tokenizer
+        self.negations = frozenset(sentiment.negations)
+        self.modifier = sentiment.modifier
+        self.words = {}
+        # len() loads the lexicon if nothing has used it yet
+        len(sentiment)
+        for w, pos in dict.items(sentiment):
+            p, s, i = pos[None]
+            modifies = any(tag in pos for tag in sentiment.modifiers)
+            self.words[w] = (p, s, i, modifies)
+        # TextBlob takes the first emoticon set that has a match
+        self.emoticons = {}
+        for (_, p), emoticons in _text.EMOTICONS.items():
+            for e in emoticons:
+                self.emoticons.setdefault(e.lower(), p)
+
+    def assessments(self, tokens):
+        """The (polarity, subjectivity) of each assessed word or phrase in tokens, a list of lowercased
+        tokens, following textblob._text.Sentiment.assessments.
+        """
+        words = self.words
+        negations = self.negations
+        a = []  # [polarity, subjectivity, intensity, negated]
+        m = None  # Preceding modifier ("really")
+        n = None  # Preceding negation ("not")
+        for w in tokens:
+            known = words.get(w)
+            if known is not None:
+                p, s, i, modifies = known
+                if m is None:
+                    a.append([p, s, i, False])
+                else:
+                    # "really good"
+                    last = a[-1]
+                    last[0] = max(-1.0, min(p * last[2], +1.0))
+                    last[1] = max(-1.0, min(s * last[2], +1.0))
+                    last[2] = i
+                if n is not None:
+                    # "not (really) good"
+                    last = a[-1]
+                    last[2] = 1.0 / last[2]
+                    last[3] = True
+                m = w if modifies else None
+                n = w if w in negations else None
+                continue
+            if w in negations:
+                n = w
+            elif n is not None and len(w.strip("'")) > 1:
+                # Negations carry across small words ("not a good")
+                n = None
+            if n is not None and m is not None and self.modifier(m):
+                # "really not good"
+                a[-1][3] = True
+                n = None
+            elif m is not None and len(w) > 2:
+                # Modifiers carry across small words ("really is a good")
+                m = None
+            if w == "!" and a:
+                a[-1][0] = max(-1.0, min(a[-1][0] * 1.25, +1.0))
+            if w == "(!)":
+                a.append([0.0, 1.0, 1.0, False])
+            if not w.isalpha() and len(w) <= 5 and w not in _text.PUNCTUATION:
+                p = self.emoticons.get(w)
+                if p is not None:
+                    a.append([p, 1.0, 1.0, False])
+        # "not good" is slightly bad, "not bad" slightly good
+        return [(p * -0.5 if negated else p, s) for p, s, _, negated in a]
+
+    def tokens(self, text):
+        return " ".join(self.tokenizer(text)).lower().split()
+
+    def score(self, texts):
+        """The polarity and subjectivity of every text in texts, as two lists of floats in order."""
+        polarity = []
+        subjectivity = []
+        doc = []
+        for k, text in enumerate(texts):
+            for p, s in self.assessments(self.tokens(text)):
+                polarity.append(p)
+                subjectivity.append(s)
+                doc.append(k)
+        # Texts without assessments get (0.0, 0.0), like TextBlob
+        doc = np.array(doc, dtype=np.intp)
+        counts = np.maximum(np.bincount(doc, minlength=len(texts)), 1)
+        polarity = np.bincount(doc, weights=polarity, minlength=len(texts)) / counts
+        subjectivity = np.bincount(doc, weights=subjectivity, minlength=len(texts)) / counts
+        return polarity.tolist(), subjectivity.tolist()
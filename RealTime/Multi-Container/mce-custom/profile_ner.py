@@ -0,0 +1,75 @@
+# Before/after report for pruning the spaCy NER pipeline with container-spacy/NER/pipeline.py.
+#
+# Loads the pipeline in full and pruned to what the components in --components need. For each it
+# reports the load time, the time per document spent in every component (from pipeline.profiled_pipe
+# over the corpus), the latency of one-document calls and the throughput of nlp.pipe. Finally it
+# checks how many documents get different entities from the pruned pipeline.
+#
+# Usage: python profile_ner.py [--model en_core_web_sm] [--components ner] [--corpus docs.txt]
+#            [--docs 2000]
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "container-spacy", "NER"))
+import pipeline  # noqa: E402
+from benchmark_ner import entities, generate_corpus  # noqa: E402
+
+
+def report(nlp, corpus, batch_size):
+    docs, timings = pipeline.profiled_pipe(nlp, corpus, batch_size)
+    for name, seconds in timings.items():
+        print("  {:<20}{:>10.3f} ms/doc".format(name, seconds * 1000 / len(corpus)))
+
+    latencies = []
+    for text in corpus[:1000]:
+        start = time.perf_counter()
+        nlp(text)
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1000
+    start = time.perf_counter()
+    list(nlp.pipe(corpus, batch_size=batch_size))
+    throughput = len(corpus) / (time.perf_counter() - start)
+    print("  single doc p50 {:.3f}ms p99 {:.3f}ms, nlp.pipe {:.0f} docs/s".format(
+        np.percentile(latencies, 50), np.percentile(latencies, 99), throughput))
+    return [entities(doc) for doc in docs]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="en_core_web_sm", help="spaCy package name or path")
+    parser.add_argument("--components", default="ner", help="components whose output is used")
+    parser.add_argument("--corpus", help="text file with one document per line")
+    parser.add_argument("--docs", type=int, default=2000, help="size of the generated corpus")
+    parser.add_argument("--batch-size", type=int, default=256)
+    args = parser.parse_args()
+
+    if args.corpus:
+        with open(args.corpus) as f:
+            corpus = [line.strip() for line in f if line.strip()]
+    else:
+        corpus = generate_corpus(args.docs)
+
+    results = {}
+    for prune in (False, True):
+        start = time.perf_counter()
+        nlp = pipeline.load(args.model, prune=prune, components=args.components.split(","))
+        startup = time.perf_counter() - start
+        # The first call loads whatever the components load lazily
+        list(nlp.pipe(corpus[:100]))
+        print("{} pipeline: startup {:.3f}s, components {}".format("pruned" if prune else "full", startup,
+                                                                   nlp.pipe_names))
+        results[prune] = report(nlp, corpus, args.batch_size)
+
+    differ = sum(full != pruned for full, pruned in zip(results[False], results[True]))
+    print("{} of {} docs ({:.2%}) get different entities after pruning".format(differ, len(corpus),
+                                                                               differ / len(corpus)))
+
+
+if __name__ == "__main__":
+    main()
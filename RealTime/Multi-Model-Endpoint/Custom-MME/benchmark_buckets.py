@@ -0,0 +1,74 @@
+# Length-bucketed batches (MODEL_SERVER_LENGTH_BUCKETS, see container/scheduler.py) against batches
+# padded to their longest text, on traffic that mixes short and long texts.
+#
+# The texts arrive in random order, a --long-share of them around 150 tokens and the rest around 10, and
+# are handed to container/model_handler.py in MMS batches of each batch size, once with a single bucket
+# and once with the buckets. For every batch size it reports requests per second, the latency of an MMS
+# batch and how many of the tokens the model ran over were padding, then the padding and the batch
+# latency of every bucket.
+#
+# Usage: python benchmark_buckets.py <model dir> [--batch-sizes 8,16,32] [--requests 256] [--long-share 0.2]
+#                                    [--buckets 16,32,64,128]
+
+import argparse
+import os
+import random
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "container"))
+import model_handler  # noqa: E402
+import scheduler  # noqa: E402
+from benchmark_handler import WORDS, context, run  # noqa: E402
+
+
+def generate_mixed_texts(count, long_share, seed=0):
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(count):
+        words = rng.randint(110, 140) if rng.random() < long_share else rng.randint(4, 12)
+        texts.append(" ".join(rng.choice(WORDS) for _ in range(words)))
+    return texts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model_dir")
+    parser.add_argument("--batch-sizes", default="8,16,32")
+    parser.add_argument("--requests", type=int, default=256)
+    parser.add_argument("--long-share", type=float, default=0.2)
+    parser.add_argument("--buckets", default="16,32,64,128")
+    args = parser.parse_args()
+
+    texts = generate_mixed_texts(args.requests, args.long_share)
+    handler = model_handler.ModelHandler()
+    handler.initialize(context(args.model_dir, 1))
+    layouts = (("one bucket", []), ("buckets " + args.buckets, scheduler.parse_boundaries(args.buckets)))
+
+    for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+        print("batch size {}".format(batch_size))
+        print("{:<28}{:>12}{:>14}{:>14}{:>12}".format("", "requests/s", "batch p50 ms", "batch p99 ms", "padding"))
+        stats = {}
+        for name, boundaries in layouts:
+            handler.length_buckets = boundaries
+            # Warm up on this layout's shapes before timing
+            run(handler, args.model_dir, texts[:batch_size * 2], batch_size)
+            handler.bucket_stats = scheduler.BucketStats()
+            throughput, latencies, _ = run(handler, args.model_dir, texts, batch_size)
+            stats[name] = handler.bucket_stats
+            print("{:<28}{:>12.1f}{:>14.1f}{:>14.1f}{:>12.1%}".format(
+                name, throughput, np.percentile(latencies, 50), np.percentile(latencies, 99),
+                handler.bucket_stats.padding()))
+            handler.bucket_stats = scheduler.BucketStats()
+        print("{:<28}{:>10}{:>10}{:>12}{:>14}{:>14}".format("bucket", "batches", "requests", "padding",
+                                                            "batch p50 ms", "batch p99 ms"))
+        for name, _ in layouts:
+            for row in stats[name].summary():
+                print("{:<28}{:>10}{:>10}{:>12.1%}{:>14.1f}{:>14.1f}".format(
+                    name if row[0] == "all" else "bucket " + row[0], *row[1:]))
+        print()
+
+
+if __name__ == "__main__":
+    main()
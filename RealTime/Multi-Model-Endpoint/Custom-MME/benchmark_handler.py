@@ -0,0 +1,167 @@
+# Throughput of container/model_handler.py for batches of requests, the way MMS calls it when a model
+# is registered with a batch_size.
+#
+# The handler is loaded in this process and called with an MMS Context (pip install multi-model-server),
+# on texts of 5 to 60 words. For every batch size it reports requests per second, the latency of a batch
+# and how many of the tokens the model ran over were padding.
+#
+# The second table compares the response formats (MODEL_SERVER_OUTPUT, _ENCODING and _DTYPE) on the
+# model output of one batch: the bytes per response, and the time to encode them in the handler and
+# decode them in the client.
+#
+# The third table times the tokenization of a batch of 32 texts: through the transformers tokenizer
+# call, as the handler used to, with the handler's BatchEncoder (see container/tokenization.py), and
+# with the BatchEncoder when all the texts are in its cache.
+#
+# Usage: python benchmark_handler.py <model dir> [--batch-sizes 1,4,8,16,32] [--requests 256]
+
+import argparse
+import io
+import json
+import os
+import pickle
+import random
+import sys
+import time
+
+import numpy as np
+from mms.context import Context, RequestProcessor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "container"))
+import model_handler  # noqa: E402
+import scheduler  # noqa: E402
+import tokenization  # noqa: E402
+
+WORDS = ["model", "endpoint", "latency", "the", "a", "of", "customer", "review", "was", "great", "slow",
+         "inference", "batch", "request", "token", "service", "and", "is", "very", "not", "amazing", "support"]
+
+
+def generate_texts(count, seed=0):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 60))) for _ in range(count)]
+
+
+def context(model_dir, batch_size):
+    ctx = Context("roberta", model_dir, {}, batch_size, None, "benchmark")
+    ctx.request_processor = [RequestProcessor({}) for _ in range(batch_size)]
+    return ctx
+
+
+def requests(texts):
+    return [{"body": bytearray(json.dumps({"text": text}).encode())} for text in texts]
+
+
+def padding(handler, texts):
+    """The fraction of the tokens the model ran over for a batch of texts that are padding."""
+    ids, _ = handler.encoder.cached_encode(texts)
+    tokens = padded = 0
+    for _, rows in scheduler.length_buckets([len(i) for i in ids], handler.length_buckets):
+        tokens += sum(len(ids[row]) for row in rows)
+        padded += len(rows) * max(len(ids[row]) for row in rows)
+    return 1 - float(tokens) / padded
+
+
+def run(handler, model_dir, texts, batch_size):
+    ctx = context(model_dir, batch_size)
+    latencies = []
+    waste = []
+    start = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        batch = texts[i:i + batch_size]
+        batch_start = time.perf_counter()
+        handler.handle(requests(batch), ctx)
+        latencies.append(time.perf_counter() - batch_start)
+        waste.append(padding(handler, batch))
+    elapsed = time.perf_counter() - start
+    return len(texts) / elapsed, np.array(latencies) * 1000, float(np.mean(waste))
+
+
+def decode(body, encoding, dtype):
+    if encoding == "npy":
+        return np.load(io.BytesIO(body), allow_pickle=False)
+    if encoding == "raw":
+        return np.frombuffer(body, dtype=dtype)
+    return pickle.loads(body)
+
+
+def formats(handler, texts, repeat=20):
+    """(output, encoding, dtype, bytes per response, encode and decode microseconds per response) rows."""
+    output, lengths = handler.inference(handler.preprocess(texts))
+    rows = []
+    for mode in model_handler.OUTPUTS:
+        for encoding in model_handler.ENCODINGS:
+            for dtype in model_handler.DTYPES:
+                if encoding == "pickle" and (mode != "pooled" or dtype != "float16"):
+                    # pickle ignores the output and dtype, one row is enough
+                    continue
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    bodies = model_handler.encode_outputs(output, lengths, mode, encoding, dtype)
+                encode = (time.perf_counter() - start) / repeat / len(texts)
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    [decode(body, encoding, dtype) for body in bodies]
+                decoded = (time.perf_counter() - start) / repeat / len(texts)
+                rows.append(("-" if encoding == "pickle" else mode, encoding, "-" if encoding == "pickle" else dtype,
+                             np.mean([len(body) for body in bodies]), encode * 1e6, decoded * 1e6))
+    return rows
+
+
+def tokenizers(handler, texts, repeat=20):
+    """(tokenization, ms per batch of texts) rows."""
+    def transformers_call():
+        handler.tokenizer(texts, max_length=model_handler.MAX_LEN, add_special_tokens=True,
+                          return_token_type_ids=False, padding="longest", return_attention_mask=True,
+                          return_tensors="pt", truncation=True)
+
+    uncached = tokenization.BatchEncoder(handler.tokenizer, model_handler.MAX_LEN, cache_size=0)
+    cached = tokenization.BatchEncoder(handler.tokenizer, model_handler.MAX_LEN)
+    rows = []
+    for name, encode in (("transformers call", transformers_call), ("BatchEncoder", lambda: uncached(texts)),
+                         ("BatchEncoder, cached", lambda: cached(texts))):
+        encode()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            encode()
+        rows.append((name, (time.perf_counter() - start) / repeat * 1000))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model_dir")
+    parser.add_argument("--batch-sizes", default="1,4,8,16,32")
+    parser.add_argument("--requests", type=int, default=256)
+    args = parser.parse_args()
+
+    texts = generate_texts(args.requests)
+    handler = model_handler.ModelHandler()
+    handler.initialize(context(args.model_dir, 1))
+    # The first calls allocate what the model needs before anything is timed
+    handler.handle(requests(texts[:4]), context(args.model_dir, 4))
+
+    rows = []
+    for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+        throughput, latencies, waste = run(handler, args.model_dir, texts, batch_size)
+        rows.append((batch_size, throughput, np.percentile(latencies, 50), np.percentile(latencies, 99), waste))
+
+    print("{:<12}{:>12}{:>14}{:>14}{:>12}".format("batch size", "requests/s", "batch p50 ms", "batch p99 ms",
+                                                 "padding"))
+    for row in rows:
+        print("{:<12}{:>12.1f}{:>14.1f}{:>14.1f}{:>12.1%}".format(*row))
+
+    print()
+    print("{:<10}{:<10}{:<10}{:>16}{:>14}{:>14}".format("output", "encoding", "dtype", "bytes/response",
+                                                        "encode us", "decode us"))
+    for row in formats(handler, texts[:8]):
+        print("{:<10}{:<10}{:<10}{:>16.0f}{:>14.1f}{:>14.1f}".format(*row))
+
+    print()
+    print("{:<24}{:>10}{:>10}".format("tokenization of 32", "ms", "speedup"))
+    rows = tokenizers(handler, texts[:32])
+    for name, ms in rows:
+        print("{:<24}{:>10.2f}{:>9.1f}x".format(name, ms, rows[0][1] / ms))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# What a cache miss costs on a multi-model endpoint: how long container/model_handler.py takes to load
+# a model, phase by phase, as MME swaps the models in and out.
+#
+# MMS loads a model by starting worker processes for it, which import the handler and call initialize.
+# The first table does the same, a fresh process for every load, going round the model directories
+# --rounds times as a busy endpoint with little memory would. The first round reads the weights from
+# disk, later ones find them in the page cache.
+#
+# Usage: python benchmark_loading.py <model dir> [<model dir> ...] [--rounds 3]
+
+import argparse
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PHASES = ("imports", "tokenizer", "model", "first inference", "initialize")
+
+
+def load(model_dirs):
+    """Load each model in model_dirs into this process, in turn, and return its load times."""
+    sys.path.insert(0, os.path.join(HERE, "container"))
+    from benchmark_handler import context
+    import model_handler
+
+    times = []
+    for model_dir in model_dirs:
+        handler = model_handler.ModelHandler()
+        handler.initialize(context(model_dir, 1))
+        times.append(handler.load_times)
+    return times
+
+
+def load_in_new_process(model_dirs):
+    # A fresh interpreter, like a new MMS worker
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(load, model_dirs).result()
+
+
+def describe(name, times):
+    print("{:<30}".format(name) + "".join("{:>18.1f}".format(np.mean([t[phase] for t in times])) for phase in PHASES))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model_dirs", nargs="+")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+    model_dirs = [os.path.abspath(d) for d in args.model_dirs]
+
+    rounds = [[load_in_new_process([d])[0] for d in model_dirs] for _ in range(args.rounds)]
+
+    header = "{:<30}".format("mean ms") + "".join("{:>18}".format(phase) for phase in PHASES)
+    print("a new worker for every load, {} models".format(len(model_dirs)))
+    print(header)
+    for i, times in enumerate(rounds):
+        describe("round {}".format(i + 1), times)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# Latency of a model in model_handler.py on its two backends, torch and onnxruntime
+# (MODEL_SERVER_BACKEND, see container/onnx_backend.py), and how far apart their outputs are.
+#
+# Both run on the threads topology.py gives one worker. The ONNX model is model.onnx in the model
+# directory, exported there first if it isn't. Reports how long each backend took to load, the p50 and
+# p99 latency of the model for batches of 1 to 32 generated texts, and the largest difference between the
+# two backends' pooled outputs and hidden states. Their kernels sum in different orders, so the outputs
+# differ in the last bits of float32, far below what float16 responses (MODEL_SERVER_DTYPE) resolve.
+#
+# Usage: python compare_backends.py <model dir> [--batch-sizes 1,2,4,8,16,32] [--texts 128]
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "container"))
+import model_handler  # noqa: E402
+import onnx_backend  # noqa: E402
+import topology  # noqa: E402
+from benchmark_handler import generate_texts  # noqa: E402
+from transformers import RobertaModel, RobertaTokenizer  # noqa: E402
+
+
+def latencies(model, batches):
+    result = []
+    for encoded in batches:
+        start = time.perf_counter()
+        with torch.no_grad():
+            model(input_ids=encoded["input_ids"], attention_mask=encoded["attention_mask"])
+        result.append(time.perf_counter() - start)
+    return np.array(result) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model_dir")
+    parser.add_argument("--batch-sizes", default="1,2,4,8,16,32")
+    parser.add_argument("--texts", type=int, default=128)
+    args = parser.parse_args()
+
+    threads = topology.from_env()
+    torch.set_num_threads(threads["intra_op_threads"])
+    print(topology.describe(threads))
+
+    texts = generate_texts(args.texts)
+    tokenizer = RobertaTokenizer.from_pretrained(args.model_dir)
+    start = time.perf_counter()
+    models = {"torch": RobertaModel.from_pretrained(args.model_dir).eval()}
+    loads = {"torch": time.perf_counter() - start}
+    start = time.perf_counter()
+    models["onnxruntime"], loaded = onnx_backend.load(args.model_dir, threads)
+    loads["onnxruntime"] = time.perf_counter() - start
+    print("torch loaded in {:.2f} s, onnxruntime in {:.2f} s ({})".format(loads["torch"], loads["onnxruntime"],
+                                                                        loaded))
+
+    batch_sizes = [int(b) for b in args.batch_sizes.split(",")]
+    print("{:<12}{:>16}{:>16}{:>16}{:>16}{:>10}".format("batch size", "torch p50 ms", "torch p99 ms", "onnx p50 ms",
+                                                       "onnx p99 ms", "speedup"))
+    for batch_size in batch_sizes:
+        batches = [tokenizer(texts[i:i + batch_size], padding="longest", truncation=True,
+                             max_length=model_handler.MAX_LEN, return_tensors="pt")
+                   for i in range(0, len(texts), batch_size)]
+        row = []
+        for name in ("torch", "onnxruntime"):
+            # Warm up on the first batches before timing
+            latencies(models[name], batches[:2])
+            timed = latencies(models[name], batches)
+            row += [np.percentile(timed, 50), np.percentile(timed, 99)]
+        print("{:<12}{:>16.1f}{:>16.1f}{:>16.1f}{:>16.1f}{:>9.2f}x".format(batch_size, *row, row[0] / row[2]))
+
+    pooled = hidden = 0.0
+    for i in range(0, len(texts), 8):
+        encoded = tokenizer(texts[i:i + 8], padding="longest", truncation=True, max_length=model_handler.MAX_LEN,
+                            return_tensors="pt")
+        with torch.no_grad():
+            expected = models["torch"](input_ids=encoded["input_ids"], attention_mask=encoded["attention_mask"])
+        actual = models["onnxruntime"](input_ids=encoded["input_ids"], attention_mask=encoded["attention_mask"])
+        mask = encoded["attention_mask"].bool()
+        pooled = max(pooled, (expected.pooler_output - actual.pooler_output).abs().max().item())
+        hidden = max(hidden, (expected.last_hidden_state - actual.last_hidden_state).abs()[mask].max().item())
+    print("largest difference to torch: pooled {:.2e}, hidden states {:.2e} (float16 resolves {:.2e} at 1.0)".format(
+        pooled, hidden, float(np.finfo(np.float16).eps)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# Latency, memory and accuracy of a model in model_handler.py with and without dynamic int8
+# quantization (MODEL_SERVER_QUANTIZE=int8, see container/quantization.py).
+#
+# Reports the size of each model's weights, how long loading took (for int8 the first load, which
+# quantizes; later ones read model.int8.pt), the latency of batches of 1 and 8
+# texts and how far the int8 pooled outputs and hidden states are from the fp32 ones, as cosine
+# similarity, over generated texts.
+#
+# Usage: python compare_quantization.py <model dir> [--texts 64]
+
+import argparse
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "container"))
+import quantization  # noqa: E402
+from benchmark_handler import generate_texts  # noqa: E402
+from transformers import RobertaModel, RobertaTokenizer  # noqa: E402
+
+
+def weights_mb(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 1e6
+
+
+def latency(model, tokenizer, texts, batch_size):
+    latencies = []
+    for i in range(0, len(texts), batch_size):
+        encoded = tokenizer(texts[i:i + batch_size], padding="longest", truncation=True, return_tensors="pt")
+        start = time.perf_counter()
+        with torch.no_grad():
+            model(input_ids=encoded["input_ids"], attention_mask=encoded["attention_mask"])
+        latencies.append(time.perf_counter() - start)
+    return np.percentile(np.array(latencies) * 1000, 50)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model_dir")
+    parser.add_argument("--texts", type=int, default=64)
+    args = parser.parse_args()
+
+    texts = generate_texts(args.texts)
+    tokenizer = RobertaTokenizer.from_pretrained(args.model_dir)
+    start = time.perf_counter()
+    model = RobertaModel.from_pretrained(args.model_dir)
+    fp32_load = time.perf_counter() - start
+    start = time.perf_counter()
+    quantized = quantization.quantize(model)
+    int8_load = fp32_load + time.perf_counter() - start
+    # Warm both up before timing them
+    latency(model, tokenizer, texts[:8], 8)
+    latency(quantized, tokenizer, texts[:8], 8)
+
+    print("{:<8}{:>12}{:>12}{:>16}{:>16}".format("model", "weights MB", "load s", "batch 1 p50 ms", "batch 8 p50 ms"))
+    for name, m, load in (("fp32", model, fp32_load), ("int8", quantized, int8_load)):
+        print("{:<8}{:>12.1f}{:>12.2f}{:>16.1f}{:>16.1f}".format(
+            name, weights_mb(m), load, latency(m, tokenizer, texts, 1), latency(m, tokenizer, texts, 8)))
+
+    pooled = []
+    hidden = []
+    for i in range(0, len(texts), 8):
+        encoded = tokenizer(texts[i:i + 8], padding="longest", truncation=True, return_tensors="pt")
+        with torch.no_grad():
+            expected = model(input_ids=encoded["input_ids"], attention_mask=encoded["attention_mask"])
+            actual = quantized(input_ids=encoded["input_ids"], attention_mask=encoded["attention_mask"])
+        mask = encoded["attention_mask"].bool()
+        pooled.append(torch.nn.functional.cosine_similarity(expected.pooler_output, actual.pooler_output, dim=-1))
+        hidden.append(torch.nn.functional.cosine_similarity(expected.last_hidden_state, actual.last_hidden_state,
+                                                            dim=-1)[mask])
+    pooled = torch.cat(pooled)
+    hidden = torch.cat(hidden)
+    print("cosine similarity to fp32: pooled mean {:.5f} min {:.5f}, hidden states mean {:.5f} min {:.5f}".format(
+        pooled.mean(), pooled.min(), hidden.mean(), hidden.min()))
+
+
+if __name__ == "__main__":
+    main()
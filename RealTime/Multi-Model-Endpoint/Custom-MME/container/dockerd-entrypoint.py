@@ -6,16 +6,24 @@ from retrying import retry
 from subprocess import CalledProcessError
 from sagemaker_inference import model_server
 
+import topology
+
 def _retry_if_error(exception):
     return isinstance(exception, CalledProcessError or OSError)
 
 @retry(stop_max_delay=1000 * 50,
        retry_on_exception=_retry_if_error)
 def _start_mms():
-    # by default the number of workers per model is 1, but we can configure it through the
-    # environment variable below if desired.
-    os.environ['MMS_DEFAULT_WORKERS_PER_MODEL'] = '2'
-    os.environ['OMP_NUM_THREADS'] = '8'
+    # Workers per model and threads per worker for the cores this container gets (see topology.py),
+    # exported for MMS and for the handler, which applies them to torch
+    threads = topology.from_env()
+    print('Topology: ' + topology.describe(threads))
+    os.environ['MMS_DEFAULT_WORKERS_PER_MODEL'] = str(threads['workers'])
+    os.environ['MODEL_SERVER_INTRA_OP_THREADS'] = str(threads['intra_op_threads'])
+    os.environ['MODEL_SERVER_INTER_OP_THREADS'] = str(threads['inter_op_threads'])
+    os.environ['OMP_NUM_THREADS'] = str(threads['intra_op_threads'])
+    os.environ['MKL_NUM_THREADS'] = str(threads['intra_op_threads'])
+    os.environ['RAYON_NUM_THREADS'] = str(threads['intra_op_threads'])
     model_server.start_model_server(handler_service='/home/model-server/model_handler.py:handle')
 
 def main():
@@ -0,0 +1,36 @@
+# Loading of the models and tokenizers, which a multi-model endpoint does on every cache miss: the first
+# request for a model that isn't loaded, or was unloaded to make room for others, waits for it.
+#
+# The weights are read from model.safetensors when the model directory has one, which transformers maps
+# into memory rather than unpickling pytorch_model.bin. The mapped weights are pages of the file, shared
+# by every worker of the model and kept in the page cache when MME unloads it, so loading it again reads
+# little from disk.
+#
+# The fast tokenizer, backed by the Rust tokenizers library, is used when it can be built: from
+# tokenizer.json, or converted from vocab.json and merges.txt. Otherwise the Python RobertaTokenizer is.
+#
+# Tokenizers aren't cached across models. MMS serves each model from worker processes of its own, and a
+# model that is unloaded and loaded again gets new ones, so a worker never loads a second model whose
+# tokenizer it could reuse.
+
+import os
+
+from transformers import RobertaModel, RobertaTokenizer, RobertaTokenizerFast
+
+SAFETENSORS_FILE = 'model.safetensors'
+
+
+def load_tokenizer(model_dir):
+    """The tokenizer of model_dir, the fast one if it can be built."""
+    try:
+        tokenizer = RobertaTokenizerFast.from_pretrained(model_dir)
+    except (ImportError, ValueError, OSError) as e:
+        print(f" tokenizer: no fast tokenizer for {model_dir}, using RobertaTokenizer: {e}")
+        tokenizer = RobertaTokenizer.from_pretrained(model_dir)
+    return tokenizer
+
+
+def load_model(model_dir):
+    """The fp32 model in model_dir, from model.safetensors if there is one."""
+    use_safetensors = os.path.exists(os.path.join(model_dir, SAFETENSORS_FILE))
+    return RobertaModel.from_pretrained(model_dir, use_safetensors=use_safetensors).eval()
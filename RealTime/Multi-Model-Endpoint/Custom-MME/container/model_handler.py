@@ -1,19 +1,58 @@
+import time
+# When the worker started importing the handler. The imports, torch and transformers above all, are
+# most of the time a worker takes to start.
+IMPORT_START = time.time()
 import os
 import json
 import sys
 import logging
 import torch
-from transformers import AutoTokenizer
 from abc import ABC
 from torch import nn
-from transformers import RobertaModel, RobertaTokenizer, AutoTokenizer, BertModel
+from transformers import RobertaModel, RobertaTokenizer
 import pickle
-import time
 import gzip
+import io
+import numpy as np
+
+import loading
+import scheduler
+import tokenization
+import topology
+
+IMPORT_MS = (time.time() - IMPORT_START) * 1000
 
 JSON_CONTENT_TYPE = 'application/json'
 PRE_TRAINED_MODEL_NAME = 'roberta-base'
 CLASS_NAMES = ['negative', 'neutral', 'positive']
+MAX_LEN = 160
+
+# The response for each text is set through the environment:
+#
+# Parameter                Environment Variable              Default Value
+# ---------                --------------------              -------------
+# what is returned         MODEL_SERVER_OUTPUT               pooled
+# how it is encoded        MODEL_SERVER_ENCODING             npy
+# float type               MODEL_SERVER_DTYPE                float16
+#
+# The outputs are pooled, the pooler output of the text (768 floats for roberta-base), cls, the hidden
+# state of its <s> token, or hidden, the hidden states of all its tokens (tokens x 768). They are
+# encoded as npy, a .npy file that np.load(io.BytesIO(body)) reads with its shape and dtype, or raw, just
+# the array's bytes in C order. pickle returns the whole model output pickled, as this handler used to,
+# whatever the output. That holds every token's hidden state in float32, about 125KB for a text of 40
+# tokens against 1.6KB for a float16 pooled output, and the client has to trust what it unpickles.
+OUTPUTS = ('pooled', 'cls', 'hidden')
+ENCODINGS = {'npy': 'application/x-npy', 'raw': 'application/octet-stream', 'pickle': 'application/python-pickle'}
+DTYPES = ('float16', 'float32')
+BACKENDS = ('torch', 'onnxruntime')
+
+OUTPUT = os.environ.get('MODEL_SERVER_OUTPUT', 'pooled')
+ENCODING = os.environ.get('MODEL_SERVER_ENCODING', 'npy')
+DTYPE = os.environ.get('MODEL_SERVER_DTYPE', 'float16')
+for name, value, choices in (('MODEL_SERVER_OUTPUT', OUTPUT, OUTPUTS), ('MODEL_SERVER_ENCODING', ENCODING, ENCODINGS),
+                             ('MODEL_SERVER_DTYPE', DTYPE, DTYPES)):
+    if value not in choices:
+        raise ValueError('{} must be one of {}, got {}'.format(name, ', '.join(choices), value))
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +67,86 @@ def list_files(startpath):
         for f in files:
             print('{}{}'.format(subindent, f))
             
+
+def encode_outputs(output, lengths, mode=OUTPUT, encoding=ENCODING, dtype=DTYPE):
+    """One response body for each text in a batch's model output.
+
+    :param output: The model output for the batch
+    :param lengths: The number of tokens of each text, without the padding
+    :return: list of bytes, in the order of the texts
+    """
+    bodies = []
+    if encoding == 'pickle':
+        for i, length in enumerate(lengths):
+            # The model output of text i as if it had been sent on its own, without the padding. The
+            # tensors are cloned, pickling a slice would write out the whole batch.
+            bodies.append(pickle.dumps(output.__class__(
+                last_hidden_state=output.last_hidden_state[i:i + 1, :length].clone(),
+                pooler_output=output.pooler_output[i:i + 1].clone())))
+        return bodies
+
+    # Convert the whole batch at once, then cut it up per text
+    if mode == 'pooled':
+        arrays = output.pooler_output.numpy().astype(dtype)
+    elif mode == 'cls':
+        arrays = output.last_hidden_state[:, 0].numpy().astype(dtype)
+    else:
+        hidden = output.last_hidden_state.numpy().astype(dtype)
+        arrays = [hidden[i, :length] for i, length in enumerate(lengths)]
+    for array in arrays:
+        if encoding == 'npy':
+            buffer = io.BytesIO()
+            np.save(buffer, np.ascontiguousarray(array), allow_pickle=False)
+            bodies.append(buffer.getvalue())
+        else:
+            bodies.append(np.ascontiguousarray(array).tobytes())
+    return bodies
+
+
+def model_settings(model_dir):
+    """Settings of the model in model_dir: the environment, overridden by handler.json in model_dir.
+
+    Parameter                Environment Variable              handler.json    Default Value
+    ---------                --------------------              ------------    -------------
+    int8 quantization        MODEL_SERVER_QUANTIZE             quantize        none (see quantization.py)
+    execution backend        MODEL_SERVER_BACKEND              backend         torch (or onnxruntime, see
+                                                                                onnx_backend.py)
+    texts with cached        MODEL_SERVER_TOKEN_CACHE_SIZE     token_cache_    4096 (see tokenization.py)
+    token ids                                                  size
+    token length bucket      MODEL_SERVER_LENGTH_BUCKETS       length_         16,32,64,128 (none for one
+    boundaries                                                 buckets         bucket, see scheduler.py)
+    """
+    settings = {'quantize': os.environ.get('MODEL_SERVER_QUANTIZE', 'none'),
+                'backend': os.environ.get('MODEL_SERVER_BACKEND', 'torch'),
+                'token_cache_size': int(os.environ.get('MODEL_SERVER_TOKEN_CACHE_SIZE', 4096)),
+                'length_buckets': os.environ.get('MODEL_SERVER_LENGTH_BUCKETS', '16,32,64,128')}
+    path = os.path.join(model_dir, 'handler.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            settings.update(json.load(f))
+    return settings
+
+
+def read_text(request):
+    """The text of one request, {"text": ...} in its JSON body."""
+    body = request.get('body')
+    if body is None:
+        body = request.get('data')
+    if isinstance(body, (bytes, bytearray)):
+        body = body.decode()
+    if isinstance(body, str):
+        body = json.loads(body)
+    text = body['text']
+    if not isinstance(text, str):
+        raise TypeError('"text" must be a string, got {}'.format(type(text).__name__))
+    return text
+
+
+# MMS hands handle() a list of requests. It holds more than one when the model was registered with a
+# batch_size above 1 (and a max_batch_delay to wait for one to fill up), e.g. through the management API:
+#   curl -X POST "localhost:8081/models?url=roberta-base&batch_size=8&max_batch_delay=20"
+# Every request in the batch gets its own response, in order. The requests are run in batches by their
+# number of tokens, see scheduler.py.
 class ModelHandler(object):
     
     def __init__(self):
@@ -46,79 +165,142 @@ class ModelHandler(object):
         self.manifest = ctx.manifest
         properties = ctx.system_properties
         self.device = 'cpu'
+        
+        # This worker's share of the cores, as dockerd-entrypoint.py planned it (see topology.py)
+        threads = topology.from_env()
+        torch.set_num_threads(threads['intra_op_threads'])
+        try:
+            torch.set_num_interop_threads(threads['inter_op_threads'])
+        except RuntimeError:
+            # Only possible before the worker's first parallel work, an earlier model may have done some
+            pass
+        # The tokenizer's threads, which run before the model's and can use the same cores. Read when
+        # it first encodes a batch in parallel.
+        os.environ.setdefault('RAYON_NUM_THREADS', str(threads['intra_op_threads']))
+        print(f" topology {torch.get_num_threads()} intra-op, {torch.get_num_interop_threads()} inter-op threads, "
+              f"{topology.describe(threads)}")
         model_dir = properties.get('model_dir')
         
         #print('model_dir ' + model_dir)
         
         self.classes = ['not paraphrase', 'paraphrase']
-        self.model = RobertaModel.from_pretrained(model_dir)
-        self.tokenizer = RobertaTokenizer.from_pretrained(model_dir)
+        # How long each phase of loading the model took, in ms. A request for a model that isn't loaded,
+        # a cache miss of the multi-model endpoint, waits for all of them.
+        self.load_times = {'imports': IMPORT_MS}
+        phase = time.time()
+        settings = model_settings(model_dir)
+        self.tokenizer = loading.load_tokenizer(model_dir)
+        self.encoder = tokenization.BatchEncoder(self.tokenizer, MAX_LEN, int(settings['token_cache_size']))
+        self.length_buckets = scheduler.parse_boundaries(settings['length_buckets'])
+        self.bucket_stats = scheduler.BucketStats()
+        self.load_times['tokenizer'] = (time.time() - phase) * 1000
+        phase = time.time()
+        if settings['backend'] not in BACKENDS:
+            raise ValueError('backend must be one of {}, got {}'.format(', '.join(BACKENDS), settings['backend']))
+        if settings['backend'] == 'onnxruntime':
+            if settings['quantize'] != 'none':
+                raise ValueError('quantize {} is only supported by the torch backend'.format(settings['quantize']))
+            # Only imported for the onnxruntime backend, so the torch backend doesn't need onnx or onnxruntime
+            import onnx_backend
+            self.model, loaded = onnx_backend.load(model_dir, threads)
+            model_loaded = f"onnxruntime {loaded}"
+        elif settings['quantize'] == 'int8':
+            # Only imported for int8 models, so the fp32 path doesn't depend on torch's quantized modules
+            import quantization
+            self.model, loaded = quantization.load(model_dir, self.tokenizer, settings)
+            model_loaded = f"quantization int8 {loaded}"
+        elif settings['quantize'] == 'none':
+            self.model = loading.load_model(model_dir)
+            model_loaded = "fp32"
+        else:
+            raise ValueError('quantize must be int8 or none, got {}'.format(settings['quantize']))
+        self.load_times['model'] = (time.time() - phase) * 1000
+        # The first batch pays for reading in the memory-mapped weights and allocating the model's
+        # buffers, better here than in the first request's latency
+        phase = time.time()
+        self.inference(self.preprocess(['warm up']))
+        self.load_times['first inference'] = (time.time() - phase) * 1000
+        self.load_times['initialize'] = (time.time() - start) * 1000
         self.initialized = True
-        print(f" perf initialize {(time.time() - start) * 1000} ms")
+        print(f" perf load tokenizer {'fast' if self.tokenizer.is_fast else 'python'}, model {model_loaded}: " +
+              ", ".join(f"{name} {ms:.1f} ms" for name, ms in self.load_times.items()))
+        print(f" perf initialize {self.load_times['initialize']} ms")
 
     def preprocess(self, input_data):
         """
-        Tokenization pre-processing
+        Tokenization pre-processing of every text in the batch MMS hands over
         """
         
         start = time.time()
  
-        MAX_LEN = 160
-        input_ids = []
-        attention_masks = []
-        token_type_ids = []
-                
-        jsontest = json.loads(input_data[0]['body'].decode())
-        review_text = jsontest['text']
-        encoded_review = self.tokenizer.encode_plus(
-                                        review_text,
-                                        max_length=MAX_LEN,
-                                        add_special_tokens=True,
-                                        return_token_type_ids=False,
-                                        pad_to_max_length=True,
-                                        return_attention_mask=True,
-                                        return_tensors='pt', truncation=True
-                                        )
-        print(f" perf preprocess tokenizer.encode_plus {(time.time() - start) * 1000} ms")
-        start = time.time()
-        input_ids = encoded_review['input_ids']
-        attention_mask = encoded_review['attention_mask']
-        output = self.model(input_ids)
-        #print(output)
-        print(f" perf preprocess self.model {(time.time() - start) * 1000} ms")
-        return output
+        # Pad to the longest text in the batch rather than to MAX_LEN, the attention mask keeps the
+        # padding out of the model's outputs. The whole batch is encoded in one call, except the texts
+        # whose token ids are cached (see tokenization.py).
+        encoded_reviews, cached = self.encoder(input_data)
+        print(f" perf preprocess tokenizer.encode_plus {(time.time() - start) * 1000} ms, "
+              f"{cached} of {len(input_data)} texts cached")
+        return encoded_reviews
 
     def inference(self, inputs):
         """
-        Predict the class of a text using a trained transformer model.
+        Run the transformer model over the tokenized batch.
         """
         start = time.time()
-        #print(inputs)
-        predictions = pickle.dumps(inputs) 
-        print(f" perf inference {(time.time() - start) * 1000} ms")
-        return predictions
-        #return inputs
+        with torch.no_grad():
+            output = self.model(input_ids=inputs['input_ids'], attention_mask=inputs['attention_mask'])
+        print(f" perf inference self.model {(time.time() - start) * 1000} ms")
+        return output, inputs['attention_mask'].sum(dim=1).tolist()
 
     def postprocess(self, inference_output):
+        """
+        Split the batch output into one response per text.
+        """
         start = time.time()
-        #return inference_output
-        #compressed = gzip.compress(inference_output)
+        output, lengths = inference_output
+        predictions = encode_outputs(output, lengths)
         print(f" postprocess {(time.time() - start) * 1000} ms")
-        return [inference_output]
+        return predictions
     
     def handle(self, data, context):
         """
         Invoke by TorchServe for prediction request.
         Do pre-processing of data, prediction using model and postprocessing of prediciton output
-        :param data: Input data for prediction
+        :param data: Input data for prediction, one entry per request in the batch
         :param context: Initial context contains model server system properties.
-        :return: prediction output
+        :return: prediction output, one entry per request in the same order
         """
         start = time.time()
-        model_input = self.preprocess(data)
-        model_output = self.inference(model_input)
-        print(f" perf handle_in {(time.time() - start) * 1000} ms")
-        return self.postprocess(model_output)
+        texts = []
+        responses = [None] * len(data)
+        for idx, request in enumerate(data):
+            try:
+                texts.append((idx, read_text(request)))
+            except (KeyError, TypeError, ValueError) as e:
+                # A malformed request fails on its own, the rest of the batch is still served
+                context.set_response_status(400, 'Expected a JSON body with a "text" field: {}'.format(e), idx)
+                context.set_response_content_type(idx, JSON_CONTENT_TYPE)
+                responses[idx] = json.dumps({'error': str(e)})
+        if texts:
+            # Tokenize once, the lengths pick the buckets and the token ids are padded per bucket
+            tokenize_start = time.time()
+            ids, cached = self.encoder.cached_encode([text for _, text in texts])
+            print(f" perf preprocess tokenizer.encode_plus {(time.time() - tokenize_start) * 1000} ms, "
+                  f"{cached} of {len(texts)} texts cached")
+            for bucket, rows in scheduler.length_buckets([len(i) for i in ids], self.length_buckets):
+                bucket_start = time.time()
+                model_input = self.encoder.pad([ids[row] for row in rows])
+                predictions = self.postprocess(self.inference(model_input))
+                for row, prediction in zip(rows, predictions):
+                    idx = texts[row][0]
+                    context.set_response_content_type(idx, ENCODINGS[ENCODING])
+                    responses[idx] = prediction
+                ms = (time.time() - bucket_start) * 1000
+                self.bucket_stats.record(bucket, model_input['attention_mask'], ms)
+                print(f" perf bucket {bucket} {ms} ms batch {len(rows)} padding "
+                      f"{1 - float(model_input['attention_mask'].float().mean()):.1%}, "
+                      f"since start {self.bucket_stats.padding(bucket):.1%}")
+        print(f" perf handle_in {(time.time() - start) * 1000} ms batch {len(data)}")
+        return responses
     
     
 _service = ModelHandler()
@@ -0,0 +1,125 @@
+# ONNX Runtime backend of the RoBERTa models, opt-in with MODEL_SERVER_BACKEND=onnxruntime or
+# {"backend": "onnxruntime"} in the model's handler.json.
+#
+# The model is served from model.onnx in the model directory. A model archive can ship one, exported
+# with the inputs input_ids and attention_mask and the outputs last_hidden_state and pooler_output.
+# Otherwise the first load exports the PyTorch model, with the batch and sequence axes dynamic so a
+# single graph serves every batch, and saves it as model.onnx for later loads, by other workers or after
+# MME evicted the model. If the directory can't be written to, the exported graph is only kept in memory.
+#
+# ONNX Runtime fuses the attention, layer norm and GELU ops of the graph when the session is created
+# (ORT_ENABLE_ALL) and runs it on the worker's share of the cores from topology.py. When a model has more
+# than one worker their intra-op threads don't spin waiting for work, which would burn the cores the other
+# workers run on.
+#
+# OnnxModel is called like the PyTorch model and returns the same output class, so the handler's
+# postprocessing and response formats are the same for both backends.
+
+import io
+import os
+import time
+
+import onnxruntime as ort
+import torch
+from torch import nn
+from transformers.modeling_outputs import BaseModelOutputWithPoolingAndCrossAttentions
+
+import loading
+
+ONNX_FILE = 'model.onnx'
+INPUTS = ('input_ids', 'attention_mask')
+OUTPUTS = ('last_hidden_state', 'pooler_output')
+OPSET = 17
+
+
+class ExportedOutputs(nn.Module):
+    """The model with its outputs as a tuple of tensors, which is what torch.onnx.export traces."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        output = self.model(input_ids=input_ids, attention_mask=attention_mask)
+        return output.last_hidden_state, output.pooler_output
+
+
+class OnnxModel(object):
+    """An ONNX Runtime session called like RobertaModel."""
+
+    def __init__(self, session):
+        self.session = session
+        self.inputs = [i.name for i in session.get_inputs()]
+        outputs = [o.name for o in session.get_outputs()]
+        missing = [name for name in INPUTS + OUTPUTS if name not in self.inputs + outputs]
+        if missing:
+            raise ValueError('{} has no {}, expected the inputs {} and the outputs {}'.format(
+                ONNX_FILE, ', '.join(missing), ', '.join(INPUTS), ', '.join(OUTPUTS)))
+
+    def __call__(self, input_ids, attention_mask):
+        feed = {'input_ids': input_ids.numpy(), 'attention_mask': attention_mask.numpy()}
+        last_hidden_state, pooler_output = self.session.run(
+            list(OUTPUTS), {name: value for name, value in feed.items() if name in self.inputs})
+        return BaseModelOutputWithPoolingAndCrossAttentions(
+            last_hidden_state=torch.from_numpy(last_hidden_state), pooler_output=torch.from_numpy(pooler_output))
+
+
+def export(model):
+    """The ONNX graph of model, as bytes, with dynamic batch and sequence axes."""
+    # Trace a padded batch, so the graph keeps the attention mask's path through the model
+    input_ids = torch.full((2, 8), model.config.pad_token_id, dtype=torch.long)
+    input_ids[:, 0] = model.config.bos_token_id
+    input_ids[0, 1:7] = input_ids[1, 1:3] = 100
+    input_ids[0, 7] = input_ids[1, 3] = model.config.eos_token_id
+    attention_mask = (input_ids != model.config.pad_token_id).long()
+    buffer = io.BytesIO()
+    with torch.no_grad():
+        torch.onnx.export(ExportedOutputs(model).eval(), (input_ids, attention_mask), buffer,
+                          input_names=list(INPUTS), output_names=list(OUTPUTS),
+                          dynamic_axes={'input_ids': {0: 'batch', 1: 'sequence'},
+                                        'attention_mask': {0: 'batch', 1: 'sequence'},
+                                        'last_hidden_state': {0: 'batch', 1: 'sequence'},
+                                        'pooler_output': {0: 'batch'}},
+                          opset_version=OPSET, dynamo=False)
+    return buffer.getvalue()
+
+
+def session_options(threads):
+    """Session options for the worker's share of the cores, threads as topology.from_env() returns it."""
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.intra_op_num_threads = threads['intra_op_threads']
+    options.inter_op_num_threads = threads['inter_op_threads']
+    if threads['workers'] > 1:
+        options.add_session_config_entry('session.intra_op.allow_spinning', '0')
+    return options
+
+
+def load(model_dir, threads):
+    """The ONNX Runtime model for model_dir.
+
+    :return: (model, where it came from: 'model.onnx' or 'exported')
+    """
+    path = os.path.join(model_dir, ONNX_FILE)
+    if os.path.exists(path):
+        graph = path
+        loaded = ONNX_FILE
+    else:
+        start = time.time()
+        graph = export(loading.load_model(model_dir))
+        print(f" perf onnx export {(time.time() - start) * 1000} ms")
+        loaded = 'exported'
+        try:
+            # Other workers of the same model may be exporting it too, each writes its own file and the
+            # rename makes the graph appear whole
+            temporary = '{}.{}'.format(path, os.getpid())
+            with open(temporary, 'wb') as f:
+                f.write(graph)
+            os.replace(temporary, path)
+        except OSError as e:
+            print(f" onnx could not save the exported model in {path}: {e}")
+    start = time.time()
+    session = ort.InferenceSession(graph, session_options(threads), providers=['CPUExecutionProvider'])
+    print(f" perf onnx session {(time.time() - start) * 1000} ms")
+    return OnnxModel(session), loaded
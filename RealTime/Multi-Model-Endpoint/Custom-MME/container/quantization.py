@@ -0,0 +1,113 @@
+# Dynamic int8 quantization of the RoBERTa models, opt-in with MODEL_SERVER_QUANTIZE=int8 or
+# {"quantize": "int8"} in the model's handler.json.
+#
+# The weights of every nn.Linear layer, which hold most of the model and do most of the work, are
+# stored as int8 and the activations are quantized on the fly, so the model takes about a third of the
+# memory and the matrix multiplications run on int8 kernels. Embeddings and layer norms stay fp32.
+#
+# The first load quantizes the fp32 model and checks how far its outputs drift on sample texts, the
+# "samples" in handler.json or a few built-in sentences. If the cosine similarity of any output to the
+# fp32 one falls below "min_cosine" (0.99) the fp32 model is served instead. Otherwise the quantized
+# state dict is saved next to the model as model.int8.pt, so later loads of the same weights, by other
+# workers or after MME evicted the model, skip the quantization and the drift check: the fp32 layers
+# are swapped for empty int8 ones and filled from the cache.
+
+import os
+import time
+
+import torch
+from torch import nn
+from torch.ao.nn.quantized.dynamic import Linear as QuantizedLinear
+
+import loading
+
+QUANTIZED_FILE = 'model.int8.pt'
+WEIGHT_FILES = ('model.safetensors', 'pytorch_model.bin')
+SAMPLES = [
+    "AWS is excited to announce that TorchServe is natively supported in Amazon SageMaker.",
+    "The service was slow and nobody answered my questions.",
+    "I would not recommend this product to anyone.",
+    "Multi-model endpoints host thousands of models behind a single endpoint.",
+]
+
+
+def quantize(model):
+    return torch.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def quantized_layers(module):
+    """module with every nn.Linear in it replaced by an int8 one of the same shape, for load_state_dict
+    to fill. Much faster than quantize() for weights that get overwritten anyway.
+    """
+    for name, child in module.named_children():
+        if type(child) is nn.Linear:
+            setattr(module, name, QuantizedLinear(child.in_features, child.out_features,
+                                                  bias_=child.bias is not None, dtype=torch.qint8))
+        else:
+            quantized_layers(child)
+    return module
+
+
+def weights_key(model_dir):
+    """What the cached quantized weights were made from: the fp32 weight files and the torch version."""
+    files = []
+    for name in WEIGHT_FILES:
+        path = os.path.join(model_dir, name)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            files.append('{}:{}:{}'.format(name, stat.st_size, int(stat.st_mtime)))
+    return 'torch {} {}'.format(torch.__version__, ' '.join(files))
+
+
+def drift(model, quantized, tokenizer, samples):
+    """The lowest cosine similarity between the fp32 and quantized outputs over the sample texts.
+
+    Both the pooler output and the hidden state of every token are compared.
+    """
+    encoded = tokenizer(samples, padding='longest', truncation=True, return_tensors='pt')
+    with torch.no_grad():
+        expected = model(input_ids=encoded['input_ids'], attention_mask=encoded['attention_mask'])
+        actual = quantized(input_ids=encoded['input_ids'], attention_mask=encoded['attention_mask'])
+    mask = encoded['attention_mask'].bool()
+    pooled = nn.functional.cosine_similarity(expected.pooler_output, actual.pooler_output, dim=-1)
+    hidden = nn.functional.cosine_similarity(expected.last_hidden_state, actual.last_hidden_state, dim=-1)[mask]
+    return min(pooled.min().item(), hidden.min().item())
+
+
+def load(model_dir, tokenizer, settings):
+    """The int8 model for model_dir, or the fp32 one if quantizing it changes its outputs too much.
+
+    :return: (model, how it was loaded: 'cached', 'quantized' or 'fp32')
+    """
+    path = os.path.join(model_dir, QUANTIZED_FILE)
+    key = weights_key(model_dir)
+    if os.path.exists(path):
+        try:
+            cached = torch.load(path, mmap=True)
+        except Exception as e:
+            print(f" quantization could not read {path}, quantizing again: {e}")
+            cached = {}
+        if cached.get('key') == key:
+            model = quantized_layers(loading.load_model(model_dir))
+            model.load_state_dict(cached['state_dict'])
+            model.eval()
+            return model, 'cached'
+        print(f" quantization {path} was not made from these weights, quantizing again")
+
+    model = loading.load_model(model_dir)
+    start = time.time()
+    quantized = quantize(model)
+    similarity = drift(model, quantized, tokenizer, settings.get('samples', SAMPLES))
+    print(f" perf quantize {(time.time() - start) * 1000} ms, lowest cosine similarity to fp32 {similarity:.5f}")
+    if similarity < settings.get('min_cosine', 0.99):
+        print(f" quantization drifts too far from fp32 (below {settings.get('min_cosine', 0.99)}), serving fp32")
+        return model, 'fp32'
+    try:
+        # Other workers of the same model may be quantizing it too, each writes its own file and the
+        # rename makes the cache appear whole
+        temporary = '{}.{}'.format(path, os.getpid())
+        torch.save({'key': key, 'state_dict': quantized.state_dict()}, temporary)
+        os.replace(temporary, path)
+    except OSError as e:
+        print(f" quantization could not cache the int8 weights in {path}: {e}")
+    return quantized, 'quantized'
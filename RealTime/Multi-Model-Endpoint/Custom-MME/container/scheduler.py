@@ -0,0 +1,88 @@
+# Length-bucketed scheduling of the batches MMS hands the handler.
+#
+# MMS collects the requests waiting for a model into a batch, up to its batch_size and for at most its
+# max_batch_delay, so no request waits longer than that for a batch, whatever its length. A batch padded
+# to its longest text makes a 10 token text cost as much as a 150 token one, so the handler tokenizes
+# the batch once, sorts the requests into buckets by their number of tokens and runs each bucket as a
+# batch of its own, padded only to the longest text in the bucket:
+#
+#   boundaries 16,32,64,128    buckets <=16, <=32, <=64, <=128 and the rest (up to MAX_LEN)
+#
+# Every bucket of the batch is run before handle() returns, as MMS needs a response for every request
+# it handed over, so none is left behind. BucketStats keeps, for every bucket, how many of the tokens
+# the model ran over were padding and how long its batches took.
+
+from collections import deque
+
+import numpy as np
+
+
+def parse_boundaries(value):
+    """The bucket boundaries in value, '16,32,64,128' or a list. Empty or 'none' for a single bucket."""
+    if isinstance(value, str):
+        value = [] if value.strip().lower() in ('', 'none') else value.split(',')
+    boundaries = sorted(int(boundary) for boundary in value)
+    if any(boundary < 1 for boundary in boundaries):
+        raise ValueError('length bucket boundaries must be positive, got {}'.format(value))
+    return boundaries
+
+
+def bucket_name(index, boundaries):
+    if not boundaries:
+        return 'all'
+    if index < len(boundaries):
+        return '<={}'.format(boundaries[index])
+    return '>{}'.format(boundaries[-1])
+
+
+def length_buckets(lengths, boundaries):
+    """The rows of a batch grouped by the bucket of their length, shortest bucket first.
+
+    :param lengths: The number of tokens of each row
+    :return: list of (bucket name, list of row indices)
+    """
+    buckets = {}
+    for row, index in enumerate(np.searchsorted(boundaries, lengths, side='left')):
+        buckets.setdefault(int(index), []).append(row)
+    return [(bucket_name(index, boundaries), buckets[index]) for index in sorted(buckets)]
+
+
+class BucketStats(object):
+    """Padding and latency of the batches run for every bucket, the latencies of the last `window` batches."""
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.buckets = {}
+
+    def record(self, bucket, attention_mask, ms):
+        stats = self.buckets.setdefault(bucket, {'batches': 0, 'requests': 0, 'tokens': 0, 'padded_tokens': 0,
+                                                 'latencies': deque(maxlen=self.window)})
+        stats['batches'] += 1
+        stats['requests'] += attention_mask.shape[0]
+        stats['tokens'] += int(attention_mask.sum())
+        stats['padded_tokens'] += attention_mask.numel()
+        stats['latencies'].append(ms)
+
+    def padding(self, bucket=None):
+        """The share of the tokens the model ran over that were padding, in bucket or in all of them."""
+        buckets = [self.buckets[bucket]] if bucket is not None else self.buckets.values()
+        tokens = sum(stats['tokens'] for stats in buckets)
+        return 1 - tokens / max(1, sum(stats['padded_tokens'] for stats in buckets))
+
+    def summary(self):
+        """(bucket, batches, requests, padding share, batch p50 ms, batch p99 ms) rows, shortest bucket first."""
+        rows = []
+        for bucket, stats in sorted(self.buckets.items(), key=lambda item: bucket_order(item[0])):
+            latencies = np.array(stats['latencies'])
+            rows.append((bucket, stats['batches'], stats['requests'], self.padding(bucket),
+                         np.percentile(latencies, 50), np.percentile(latencies, 99)))
+        return rows
+
+
+def bucket_order(bucket):
+    if bucket.startswith('<='):
+        return int(bucket[2:])
+    if bucket.startswith('>'):
+        return int(bucket[1:]) + 0.5
+    return 0
+
@@ -0,0 +1,80 @@
+# Tokenization of the batches MMS hands the handler.
+#
+# A fast tokenizer is backed by the Rust tokenizers library, which encodes a whole batch in one call, on
+# RAYON_NUM_THREADS threads (the worker's intra-op threads, see topology.py). BatchEncoder calls it
+# directly rather than through the transformers tokenizer call, which does a lot of work in Python for
+# each batch, and pads the batch itself. Without a fast tokenizer it falls back to that call.
+#
+# The token ids of the last MODEL_SERVER_TOKEN_CACHE_SIZE texts are kept in an LRU cache, so texts that
+# are sent again, retries or the same query from many clients, aren't tokenized again.
+
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+
+class BatchEncoder(object):
+    """Tokenizes batches of texts to padded input_ids and attention_mask tensors."""
+
+    def __init__(self, tokenizer, max_length, cache_size=4096):
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.backend = tokenizer.backend_tokenizer if tokenizer.is_fast else None
+
+    def encode(self, texts):
+        """The token ids of each text, with the special tokens and truncated to max_length."""
+        if self.backend is not None:
+            # Calling the tokenizer, as the int8 drift check does, can leave padding set on the backend,
+            # so set what this encoder needs on every call
+            self.backend.no_padding()
+            self.backend.enable_truncation(self.max_length)
+            encode_batch = getattr(self.backend, 'encode_batch_fast', self.backend.encode_batch)
+            return [np.array(encoding.ids, dtype=np.int64) for encoding in encode_batch(texts)]
+        encoded = self.tokenizer(texts, max_length=self.max_length, add_special_tokens=True, truncation=True,
+                                 return_token_type_ids=False, return_attention_mask=False)
+        return [np.array(ids, dtype=np.int64) for ids in encoded['input_ids']]
+
+    def cached_encode(self, texts):
+        """The token ids of each text, from the cache where possible.
+
+        :return: (list of token id arrays, how many of the texts were in the cache)
+        """
+        ids = {}
+        for text in texts:
+            if text in self.cache:
+                self.cache.move_to_end(text)
+                ids[text] = self.cache[text]
+        cached = sum(text in ids for text in texts)
+        # Each text that isn't cached is encoded once, however often it is in the batch
+        missing = [text for text in dict.fromkeys(texts) if text not in ids]
+        if missing:
+            for text, encoded in zip(missing, self.encode(missing)):
+                ids[text] = encoded
+                if self.cache_size > 0:
+                    self.cache[text] = encoded
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return [ids[text] for text in texts], cached
+
+    def pad(self, ids):
+        """Token id arrays padded to the longest one.
+
+        :return: {'input_ids': tensor, 'attention_mask': tensor}
+        """
+        input_ids = np.full((len(ids), max(len(i) for i in ids)), self.tokenizer.pad_token_id, dtype=np.int64)
+        attention_mask = np.zeros_like(input_ids)
+        for row, encoded in enumerate(ids):
+            input_ids[row, :len(encoded)] = encoded
+            attention_mask[row, :len(encoded)] = 1
+        return {'input_ids': torch.from_numpy(input_ids), 'attention_mask': torch.from_numpy(attention_mask)}
+
+    def __call__(self, texts):
+        """The batch of texts padded to its longest text.
+
+        :return: ({'input_ids': tensor, 'attention_mask': tensor}, how many of the texts were in the cache)
+        """
+        ids, cached = self.cached_encode(texts)
+        return self.pad(ids), cached
@@ -0,0 +1,102 @@
+# CPU topology of the MMS workers. Every model MMS loads gets MMS_DEFAULT_WORKERS_PER_MODEL worker
+# processes, and torch in each of them runs its ops on a pool of intra-op threads, one per core unless
+# told otherwise. dockerd-entrypoint.py works out how many cores the container may really use, the
+# affinity mask capped by the cgroup CPU quota, and splits them between workers and threads by policy:
+#
+#   throughput  workers of MODEL_SERVER_THREADS_PER_WORKER (4) threads each, as many as fit in the cores,
+#               so concurrent requests run side by side. Every worker holds its own copy of the model.
+#   latency     one worker per model using all the cores, so a single request runs as fast as it can
+#
+# On a multi-model endpoint several models can be busy at once. MODEL_SERVER_ACTIVE_MODELS divides the
+# cores between that many models first.
+#
+# We set the following parameters:
+#
+# Parameter                Environment Variable              Default Value
+# ---------                --------------------              -------------
+# policy                   MODEL_SERVER_THREAD_POLICY        throughput
+# threads of a worker for  MODEL_SERVER_THREADS_PER_WORKER   4
+# the throughput policy
+# models busy at once      MODEL_SERVER_ACTIVE_MODELS        1
+# workers per model        MMS_DEFAULT_WORKERS_PER_MODEL     from the policy
+# torch intra-op threads   MODEL_SERVER_INTRA_OP_THREADS     from the policy
+# torch inter-op threads   MODEL_SERVER_INTER_OP_THREADS     1
+#
+# Workers and threads that are set explicitly are kept as they are. The entrypoint exports what it
+# chose, with OMP_NUM_THREADS, MKL_NUM_THREADS and RAYON_NUM_THREADS (the tokenizer's threads), and the
+# handler applies it to torch in initialize.
+
+import math
+import multiprocessing
+import os
+
+POLICIES = ('throughput', 'latency')
+
+
+def cpu_quota():
+    """The number of CPUs the cgroup CPU quota allows, or None if there is no quota."""
+    # cgroup v2
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()[:2]
+        if quota != 'max':
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    # cgroup v1
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+            quota = int(f.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+            period = int(f.read())
+        if quota > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def available_cpus():
+    """The cores this process may run on, capped by the CPU quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = multiprocessing.cpu_count()
+    quota = cpu_quota()
+    if quota is not None:
+        # A quota of 2.5 CPUs keeps 3 threads busy only by throttling them
+        cpus = min(cpus, max(1, int(math.floor(quota))))
+    return cpus
+
+
+def plan(cpus, policy='throughput', threads_per_worker=4, active_models=1):
+    """(workers per model, intra-op threads, inter-op threads) that fill cpus cores without oversubscribing."""
+    if policy not in POLICIES:
+        raise ValueError('MODEL_SERVER_THREAD_POLICY must be one of {}, got {}'.format(', '.join(POLICIES), policy))
+    cpus = max(1, cpus // max(1, active_models))
+    if policy == 'latency':
+        return 1, cpus, 1
+    threads = max(1, min(threads_per_worker, cpus))
+    return max(1, cpus // threads), threads, 1
+
+
+def from_env():
+    """The topology for this container, as a dict, with the values set in the environment kept."""
+    cpus = available_cpus()
+    policy = os.environ.get('MODEL_SERVER_THREAD_POLICY', 'throughput')
+    workers, intra, inter = plan(cpus, policy, int(os.environ.get('MODEL_SERVER_THREADS_PER_WORKER', 4)),
+                                 int(os.environ.get('MODEL_SERVER_ACTIVE_MODELS', 1)))
+    return {
+        'cpus': cpus,
+        'quota': cpu_quota(),
+        'policy': policy,
+        'workers': int(os.environ.get('MMS_DEFAULT_WORKERS_PER_MODEL', workers)),
+        'intra_op_threads': int(os.environ.get('MODEL_SERVER_INTRA_OP_THREADS', intra)),
+        'inter_op_threads': int(os.environ.get('MODEL_SERVER_INTER_OP_THREADS', inter)),
+    }
+
+
+def describe(topology):
+    return '{cpus} CPUs (quota {quota}), {policy} policy: {workers} workers per model of {intra_op_threads} ' \
+           'intra-op and {inter_op_threads} inter-op threads'.format(**topology)
@@ -16,7 +16,7 @@ print(region)
 sagemaker_session = sagemaker.Session()
 
 #Build tar file with model data + inference code
-bashCommand = "tar -cvpzf model.tar.gz model.joblib model.py serving.properties requirements.txt"
+bashCommand = "tar -cvpzf model.tar.gz model.joblib model.py request_log.py serving.properties requirements.txt"
 process = subprocess.Popen(bashCommand.split(), stdout=subprocess.PIPE)
 output, error = process.communicate()
 
@@ -19,6 +19,10 @@ import joblib
 from djl_python import Input
 from djl_python import Output
 
+import request_log
+
+log = request_log.get_logger("model")
+
 
 class SKLearnRegressor(object):
     def __init__(self):
@@ -47,19 +51,16 @@ class SKLearnRegressor(object):
         
         try:
             data = inputs.get_as_json()
-            print(data)
-            print(type(data))
             res = self.model.predict(data).tolist()[0]
             outputs = Output()
             outputs.add_as_json(res)
+            if request_log.sampled("/invocations"):
+                log.info("Invoked", extra={"fields": {"result": res}, "payloads": {"input": data}})
         except Exception as e:
-            logging.exception("inference failed")
+            log.exception("inference failed", extra={"payloads": {"input": inputs.get_as_bytes()}})
             # error handling
             outputs = Output().error(str(e))
         
-        print(outputs)
-        print(type(outputs))
-        print("Returning inference---------")
         return outputs
 
 
@@ -5,8 +5,34 @@ import os
 import json
 import logging
 
-#Load in model
-nlp = spacy.load('en_core_web_sm')
+import pipeline
+import request_log
+
+log = request_log.get_logger("predictor")
+
+#Load in model, only the components NER needs with MODEL_SERVER_NLP_PRUNE (see pipeline.py)
+nlp = pipeline.load('en_core_web_sm')
+profile = pipeline.profiling()
+
+# Lists of documents go through nlp.pipe, which tokenizes and tags them batch_size documents at a
+# time. With MODEL_SERVER_NLP_PROCESSES above 1, lists longer than one batch are spread over that many
+# processes, which are started for every such request, so it only pays off for lists of thousands.
+batch_size = int(os.environ.get('MODEL_SERVER_NLP_BATCH_SIZE', 256))
+n_process = int(os.environ.get('MODEL_SERVER_NLP_PROCESSES', 1))
+
+
+def entities(doc):
+    return [(X.text, X.label_) for X in doc.ents]
+
+
+def predict(texts):
+    """Return the entities of every text in texts, in order."""
+    if profile:
+        docs, timings = pipeline.profiled_pipe(nlp, texts, batch_size)
+        log.info(pipeline.format_profile(timings, len(texts)), extra={"fields": {"docs": len(texts)}})
+        return [entities(doc) for doc in docs]
+    processes = n_process if len(texts) > batch_size else 1
+    return [entities(doc) for doc in nlp.pipe(texts, batch_size=batch_size, n_process=processes)]
 
 
 # The flask app for serving predictions
@@ -22,17 +48,19 @@ def ping():
 @app.route('/invocations', methods=['POST'])
 def transformation():
     
-    #Process input
+    #Process input, either one document or a list of them
     input_json = flask.request.get_json()
     resp = input_json['input']
     
     #NER
-    doc = nlp(resp)
-    entities = [(X.text, X.label_) for X in doc.ents]
+    if isinstance(resp, list):
+        output = predict(resp)
+    else:
+        output = predict([resp])[0]
 
-    # Transform predictions to JSON
+    # Transform predictions to JSON, a list of entities per document for a list input
     result = {
-        'output': entities
+        'output': output
         }
 
     resultjson = json.dumps(result)